@@ -0,0 +1,244 @@
+import re
+import json
+import time
+import random
+import hashlib
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 16 * 1024
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+MP3_BLOCK = MP3_FRAME * (CHUNK_SIZE // len(MP3_FRAME) + 2)
+
+class MockSoundcloud(object):
+    """ Stand-in for the parts of the SoundCloud API and site that soundplow talks to, served from a local thread.
+        Every request waits `latency` seconds, fails with a 503 at `error_rate`, and MP3 bodies are sent
+        at no more than `bandwidth` bytes per second per connection. With `rate_limit` set, API requests
+        beyond that many at once get a 429 with a Retry-After, like the real API throttling a client id.
+    """
+    def __init__(self, latency=0.05, bandwidth=2 * 1024 * 1024, error_rate=0.0, track_size=1024 * 1024, rate_limit=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.track_size = track_size
+        self.rate_limit = rate_limit
+        self.api_in_flight = 0
+
+        self.lock = Lock()
+        self.tracks = {}
+        self.users = {}
+        self.favorites = {}
+        self.requests = {}
+        self.next_track_id = 1000
+
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.base_url = 'http://{host}:{port}'.format(host=host, port=self.server.server_address[1])
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_user(self, username):
+        with self.lock:
+            user = {'id': len(self.users) + 1, 'kind': 'user', 'username': username, 'permalink': username}
+            self.users[username] = user
+            self.favorites[user['id']] = []
+        return user
+
+    def add_track(self, username, title, genre='Electronic'):
+        user = self.users.get(username) or self.add_user(username)
+        with self.lock:
+            track_id = self.next_track_id
+            self.next_track_id += 1
+            self.tracks[track_id] = {
+                'id': track_id,
+                'kind': 'track',
+                'title': title,
+                'user': {'id': user['id'], 'username': username},
+                'genre': genre,
+                'created_at': '2018/01/01 12:00:00 +0000',
+                'duration': 180000,
+                'permalink_url': self.track_url(username, track_id),
+                'artwork_url': '{base}/artwork/{user}-large.jpg'.format(base=self.base_url, user=username),
+                'stream_url': '{base}/tracks/{id}/stream'.format(base=self.base_url, id=track_id),
+            }
+        return track_id
+
+    def like(self, username, track_id):
+        """ Makes the user like a track, newest likes first like the real favorites endpoint. """
+        with self.lock:
+            self.favorites[self.users[username]['id']].insert(0, track_id)
+
+    def track_url(self, username, track_id):
+        # Keep "soundcloud.com" in the path, soundplow refuses links without it
+        return '{base}/soundcloud.com/{user}/track-{id}'.format(base=self.base_url, user=username, id=track_id)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_body(self, status, body, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, data, headers=None):
+                self.send_body(200, json.dumps(data).encode(), headers=headers)
+
+            def redirect(self, location):
+                self.send_body(302, b'', headers={'Location': location})
+
+            def not_found(self):
+                self.send_body(404, b'{"errors": [{"error_message": "404 - Not Found"}]}')
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                for pattern, route in ROUTES:
+                    match = re.match(pattern, url.path)
+                    if match is not None:
+                        mock.count(route.__name__)
+                        limited = mock.rate_limit > 0 and route not in UNLIMITED_ROUTES
+                        if limited:
+                            with mock.lock:
+                                mock.api_in_flight += 1
+                        try:
+                            time.sleep(mock.latency)
+                            if limited and mock.api_in_flight > mock.rate_limit:
+                                mock.count('throttled')
+                                self.send_body(429, b'{"errors": [{"error_message": "429 - Too Many Requests"}]}', headers={'Retry-After': '1'})
+                            elif mock.error_rate > 0 and random.random() < mock.error_rate:
+                                self.send_body(503, b'{"errors": [{"error_message": "503 - Service Unavailable"}]}', headers={'Retry-After': '1'})
+                            else:
+                                route(self, query, *match.groups())
+                        finally:
+                            if limited:
+                                with mock.lock:
+                                    mock.api_in_flight -= 1
+                        return
+
+                time.sleep(mock.latency)
+                self.not_found()
+
+            def resolve(self, query):
+                target = query.get('url', '')
+                match = re.search(r'/track-(\d+)$', target)
+                if match is not None and int(match.group(1)) in mock.tracks:
+                    self.redirect('{base}/tracks/{id}'.format(base=mock.base_url, id=match.group(1)))
+                    return
+                username = target.rstrip('/').rsplit('/', 1)[-1]
+                if username in mock.users:
+                    self.redirect('{base}/users/{id}'.format(base=mock.base_url, id=mock.users[username]['id']))
+                    return
+                self.not_found()
+
+            def track(self, query, track_id):
+                track = mock.tracks.get(int(track_id))
+                if track is None:
+                    return self.not_found()
+                self.send_json(track)
+
+            def search(self, query):
+                words = query.get('q', '').lower()
+                offset = int(query.get('offset', 0))
+                limit = int(query.get('limit', 50))
+                with mock.lock:
+                    found = [track for track in mock.tracks.values() if words in track['title'].lower()]
+                self.send_json(found[offset:offset + limit])
+
+            def user(self, query, user_id):
+                for user in mock.users.values():
+                    if user['id'] == int(user_id):
+                        return self.send_json(user)
+                self.not_found()
+
+            def favorites(self, query, user_id):
+                with mock.lock:
+                    liked = list(mock.favorites.get(int(user_id), []))
+                limit = int(query.get('limit', 50))
+                if query.get('linked_partitioning'):
+                    # Paged like the real API, with the next page's full url in next_href
+                    offset = int(query.get('offset', 0))
+                    page = [mock.tracks[track_id] for track_id in liked[offset:offset + limit]]
+                    next_href = None
+                    if offset + limit < len(liked):
+                        next_href = '{base}/users/{id}/favorites?linked_partitioning=1&limit={limit}&offset={offset}'.format(
+                            base=mock.base_url, id=user_id, limit=limit, offset=offset + limit)
+                    return self.send_json({'collection': page, 'next_href': next_href})
+
+                liked = liked[:limit]
+                etag = '"{}"'.format(hashlib.sha1(json.dumps(liked).encode()).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    return self.send_body(304, b'', headers={'ETag': etag})
+                self.send_json([mock.tracks[track_id] for track_id in liked], headers={'ETag': etag})
+
+            def streams(self, query, track_id):
+                if int(track_id) not in mock.tracks:
+                    return self.not_found()
+                self.send_json({'http_mp3_128_url': '{base}/mp3/{id}.mp3'.format(base=mock.base_url, id=track_id)})
+
+            def mp3(self, query, track_id):
+                size = mock.track_size
+                start = 0
+                match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if match is not None:
+                    start = int(match.group(1))
+                    if start >= size:
+                        return self.send_body(416, b'')
+
+                self.send_response(206 if start > 0 else 200)
+                self.send_header('Content-Type', 'audio/mpeg')
+                self.send_header('Content-Length', str(size - start))
+                if start > 0:
+                    self.send_header('Content-Range', 'bytes {start}-{end}/{size}'.format(start=start, end=size - 1, size=size))
+                self.end_headers()
+
+                # Cut chunks out of one repeating block so the server's own memory doesn't skew the numbers
+                for position in range(start, size, CHUNK_SIZE):
+                    skip = position % len(MP3_FRAME)
+                    chunk = MP3_BLOCK[skip:skip + min(CHUNK_SIZE, size - position)]
+                    self.wfile.write(chunk)
+                    if mock.bandwidth:
+                        time.sleep(len(chunk) / float(mock.bandwidth))
+
+            def artwork(self, query, name):
+                # Same bytes for every track of a user, like a reused cover
+                self.send_body(200, hashlib.sha1(name.encode()).digest() * 2048, content_type='image/jpeg')
+
+            def page(self, query, username, track_id):
+                self.send_body(200, '<html><head><meta content="soundcloud://sounds:{id}"></head></html>'.format(id=track_id).encode(), content_type='text/html')
+
+        ROUTES = [
+            (r'^/resolve$', Handler.resolve),
+            (r'^/tracks/(\d+)$', Handler.track),
+            (r'^/tracks$', Handler.search),
+            (r'^/users/(\d+)$', Handler.user),
+            (r'^/users/(\d+)/favorites$', Handler.favorites),
+            (r'^/i1/tracks/(\d+)/streams$', Handler.streams),
+            (r'^/mp3/(\d+)\.mp3$', Handler.mp3),
+            (r'^/artwork/(.+)$', Handler.artwork),
+            (r'^/soundcloud\.com/([^/]+)/track-(\d+)$', Handler.page),
+        ]
+        UNLIMITED_ROUTES = (Handler.mp3, Handler.artwork, Handler.page)
+        return Handler
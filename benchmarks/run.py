@@ -0,0 +1,222 @@
+""" Benchmarks soundplow against the local mock SoundCloud server and saves the numbers,
+    so each run can be compared with the previous one:
+
+        python benchmarks/run.py --tracks 200 --latency 0.05 --bandwidth 2 --label my-change
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'soundplow'))
+
+import soundplow
+from controller import Controller
+from likes import LikeTracker
+from mock_server import MockSoundcloud
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+REGRESSION_THRESHOLD = 0.10
+NOISE_FLOOR = 0.001
+
+# Whether a bigger number is better, used when comparing runs
+METRICS = {
+    'batch_tracks_per_second': True,
+    'batch_megabytes_per_second': True,
+    'batch_peak_memory_mb': False,
+    'like_latency_mean': False,
+    'like_latency_max': False,
+    'search_latency_cold': False,
+    'search_latency_warm': False,
+}
+
+SETTINGS = """[general]
+output = {output}
+workers = {workers}
+
+[artwork]
+path = {artwork}
+
+[jobs]
+path = {jobs}
+
+[dedup]
+path = {dedup}
+mode = off
+
+[like]
+min_interval = 0.2
+max_interval = 5.0
+"""
+
+def build_app(server, work_dir, workers):
+    """ Wires a headless Controller and Soundplow up to the mock server, keeping every file inside work_dir. """
+    config_file = os.path.join(work_dir, 'settings.ini')
+    with open(config_file, 'w') as f:
+        f.write(SETTINGS.format(output=os.path.join(work_dir, 'music'), workers=workers, artwork=os.path.join(work_dir, 'artwork'), jobs=os.path.join(work_dir, 'jobs.sqlite'),
+                                dedup=os.path.join(work_dir, 'dedup.sqlite')))
+
+    controller = Controller(config_file)
+    controller.like_tracker = LikeTracker(os.path.join(work_dir, 'likes.json'))
+    model = soundplow.Soundplow('benchmark-client-id', api_host=server.base_url)
+    controller.set_model(model)
+    model.set_controller(controller)
+    controller.load()
+    model.load()
+    return controller
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def bench_batch(server, controller, args):
+    urls = []
+    for number in range(args.tracks):
+        # A handful of uploaders, like a real link list, so artwork gets reused
+        username = 'artist{}'.format(number % 20)
+        urls.append(server.track_url(username, server.add_track(username, '{} - Track {}'.format(username, number))))
+
+    tracemalloc.start()
+    start = time.time()
+    results = controller.batch_download_urls(urls, workers=args.workers)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    downloaded = results[soundplow.DownloadResult.DOWNLOADED]
+    return {
+        'batch_seconds': elapsed,
+        'batch_downloaded': downloaded,
+        'batch_failed': results[soundplow.DownloadResult.FAILED],
+        'batch_tracks_per_second': downloaded / elapsed,
+        'batch_megabytes_per_second': downloaded * server.track_size / elapsed / (1024 * 1024),
+        'batch_peak_memory_mb': peak / (1024 * 1024),
+    }
+
+def bench_likes(server, controller, args):
+    server.add_user('listener')
+    server.like('listener', server.add_track('someone', 'someone - Already Liked'))
+
+    # Other accounts watched alongside, which only ever add to the polling load
+    usernames = ['listener']
+    for number in range(args.watched_users):
+        usernames.append(server.add_user('watched{}'.format(number))['username'])
+
+    controller.toggle_listen_for_likes(','.join(usernames))
+    user_id = controller.model.get_user('listener').id
+    wait_for(lambda: controller.like_tracker.knows(user_id), 30)
+    threads = threading.active_count()
+
+    latencies = []
+    for number in range(args.likes):
+        track_id = server.add_track('someone', 'someone - New Like {}'.format(number))
+        server.like('listener', track_id)
+        start = time.time()
+        if wait_for(lambda: controller.model.library.contains(track_id), 60):
+            latencies.append(time.time() - start)
+        # Give the poller time to back off, like a user liking tracks now and then
+        time.sleep(args.like_gap)
+
+    controller.toggle_listen_for_likes(None)
+    return {
+        'like_latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'like_latency_max': max(latencies) if latencies else None,
+        'like_detected': len(latencies),
+        'like_watched_users': len(usernames),
+        'like_threads': threads,
+    }
+
+def bench_search(server, controller, args):
+    def timed(query):
+        start = time.time()
+        controller.get_search_results(query)
+        return time.time() - start
+
+    queries = ['track {}'.format(number) for number in range(args.searches)]
+    cold = [timed(query) for query in queries]
+    warm = [timed(query) for query in queries]
+    return {
+        'search_latency_cold': sum(cold) / len(cold),
+        'search_latency_warm': sum(warm) / len(warm),
+    }
+
+def default_label():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARKS_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return time.strftime('%Y%m%d-%H%M%S')
+
+def compare(current, previous):
+    print("Compared with {label}:".format(label=previous['label']))
+    for metric, higher_is_better in METRICS.items():
+        before, after = previous['metrics'].get(metric), current['metrics'].get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = change < -REGRESSION_THRESHOLD if higher_is_better else change > REGRESSION_THRESHOLD
+        worse = worse and abs(after - before) > NOISE_FLOOR
+        print("  {metric:28} {before:10.3f} -> {after:10.3f} ({change:+.0%}){flag}".format(
+            metric=metric, before=before, after=after, change=change, flag='  REGRESSION' if worse else ''))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks soundplow against a local mock SoundCloud server.')
+    parser.add_argument('--tracks', type=int, default=200, help='tracks in the batch download (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent downloads (default: %(default)s)')
+    parser.add_argument('--likes', type=int, default=5, help='likes to detect (default: %(default)s)')
+    parser.add_argument('--watched-users', type=int, default=0, help='extra idle accounts watched during the like benchmark (default: %(default)s)')
+    parser.add_argument('--like-gap', type=float, default=2.0, help='seconds between likes (default: %(default)s)')
+    parser.add_argument('--searches', type=int, default=10, help='distinct search queries (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request (default: %(default)s)')
+    parser.add_argument('--bandwidth', type=float, default=2.0, help='MB/s per MP3 transfer, 0 for unlimited (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503 (default: %(default)s)')
+    parser.add_argument('--rate-limit', type=int, default=0, help='concurrent API requests before the server answers 429, 0 for none (default: %(default)s)')
+    parser.add_argument('--track-size', type=float, default=1.0, help='MB per MP3 (default: %(default)s)')
+    parser.add_argument('--label', default=None, help='name of this run (default: git describe)')
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    args = parser.parse_args(argv)
+
+    server = MockSoundcloud(latency=args.latency, bandwidth=int(args.bandwidth * 1024 * 1024),
+                            error_rate=args.error_rate, track_size=int(args.track_size * 1024 * 1024),
+                            rate_limit=args.rate_limit).start()
+    work_dir = tempfile.mkdtemp(prefix='soundplow-benchmark-')
+    controller = build_app(server, work_dir, args.workers)
+
+    metrics = {}
+    try:
+        metrics.update(bench_batch(server, controller, args))
+        metrics.update(bench_likes(server, controller, args))
+        metrics.update(bench_search(server, controller, args))
+    finally:
+        controller.shutdown()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    metrics['requests_by_endpoint'] = server.requests
+
+    label = args.label or default_label()
+    current = {'label': label, 'time': time.time(), 'parameters': vars(args), 'metrics': metrics}
+    print(json.dumps(current, indent=2, default=str))
+
+    previous_runs = sorted(glob.glob(os.path.join(args.results_dir, '*.json')), key=os.path.getmtime)
+    if previous_runs:
+        with open(previous_runs[-1], 'r') as f:
+            compare(current, json.load(f))
+
+    if not os.path.isdir(args.results_dir):
+        os.makedirs(args.results_dir)
+    with open(os.path.join(args.results_dir, label + '.json'), 'w') as f:
+        json.dump(current, f, indent=2, default=str)
+
+if __name__ == '__main__':
+    main()
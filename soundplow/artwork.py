@@ -0,0 +1,123 @@
+import os
+import time
+import hashlib
+import sqlite3
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_ARTWORK_PATH = 'resources/artwork'
+DEFAULT_ARTWORK_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_ARTWORK_WORKERS = 4
+INDEX_FILE = 'index.sqlite'
+
+class ArtworkCache(object):
+    """ On-disk artwork store. Images are saved under the sha1 of their content, so the same cover reached
+        through different urls is stored once, and an index maps artwork urls to those hashes.
+        Once the images take more than max_bytes, the least recently used ones are deleted.
+        prefetch() downloads in the background so artwork never holds up the audio.
+    """
+    def __init__(self, fetch, path=DEFAULT_ARTWORK_PATH, max_bytes=DEFAULT_ARTWORK_MAX_BYTES, workers=DEFAULT_ARTWORK_WORKERS):
+        self.fetch = fetch
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.db = sqlite3.connect(os.path.join(path, INDEX_FILE), check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS artwork (url TEXT PRIMARY KEY, hash TEXT)')
+        self.db.commit()
+
+        # hash -> [size, last used], rebuilt from the files themselves
+        self.images = {}
+        for name in os.listdir(path):
+            if name.endswith('.jpg'):
+                stat = os.stat(os.path.join(path, name))
+                self.images[name[:-len('.jpg')]] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self.images.values())
+
+    def image_path(self, image_hash):
+        return os.path.join(self.path, image_hash + '.jpg')
+
+    def prefetch(self, url):
+        """ Returns a Future with the artwork bytes (or None), requests for the same url share one download. """
+        with self.lock:
+            future = self.in_flight.get(url)
+            if future is None:
+                future = self.in_flight[url] = self.executor.submit(self.get, url)
+                future.add_done_callback(lambda done: self.finish_prefetch(url))
+        return future
+
+    def finish_prefetch(self, url):
+        with self.lock:
+            self.in_flight.pop(url, None)
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute('SELECT hash FROM artwork WHERE url = ?', (url,)).fetchone()
+        if row is not None and row[0] in self.images:
+            image_hash = row[0]
+            try:
+                with open(self.image_path(image_hash), 'rb') as image_file:
+                    data = image_file.read()
+            except OSError:
+                data = None
+            if data is not None:
+                self.touch(image_hash)
+                return data
+
+        data = self.fetch(url)
+        if data is not None:
+            self.store(url, data)
+        return data
+
+    def touch(self, image_hash):
+        # The file's mtime doubles as its last use, so the LRU order survives restarts
+        now = time.time()
+        with self.lock:
+            entry = self.images.get(image_hash)
+            if entry is not None:
+                entry[1] = now
+                try:
+                    os.utime(self.image_path(image_hash), (now, now))
+                except OSError:
+                    pass
+
+    def store(self, url, data):
+        image_hash = hashlib.sha1(data).hexdigest()
+        image_path = self.image_path(image_hash)
+
+        with self.lock:
+            if image_hash not in self.images:
+                temp_path = image_path + '.tmp'
+                with open(temp_path, 'wb') as image_file:
+                    image_file.write(data)
+                os.replace(temp_path, image_path)
+                self.images[image_hash] = [len(data), 0]
+                self.total_bytes += len(data)
+            self.db.execute('INSERT OR REPLACE INTO artwork VALUES (?, ?)', (url, image_hash))
+            self.db.commit()
+        self.touch(image_hash)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            for image_hash, (size, _) in sorted(self.images.items(), key=lambda item: item[1][1]):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self.image_path(image_hash))
+                except OSError:
+                    pass
+                del self.images[image_hash]
+                self.total_bytes -= size
+                self.db.execute('DELETE FROM artwork WHERE hash = ?', (image_hash,))
+            self.db.commit()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.db.close()
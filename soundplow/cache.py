@@ -0,0 +1,97 @@
+import json
+import time
+import sqlite3
+from threading import Lock
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 6 * 60 * 60
+
+class MetadataCache(object):
+    """ In-memory LRU cache of JSON-serializable API data with per-entry TTL.
+        When given a path, entries are also written through to a SQLite database so they survive restarts.
+        Keys are grouped by namespace ('track', 'user', 'url', ...) and always compared as strings.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key TEXT, value TEXT, stored REAL, PRIMARY KEY (namespace, key))')
+            self.db.execute('DELETE FROM cache WHERE stored < ?', (time.time() - self.ttl,))
+            self.db.commit()
+
+    def get(self, namespace, key, ttl=None):
+        cache_key = (namespace, str(key))
+        now = time.time()
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None and self.db is not None:
+                row = self.db.execute('SELECT value, stored FROM cache WHERE namespace = ? AND key = ?', cache_key).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self.remember(cache_key, entry)
+
+            if entry is not None and now - entry[1] > ttl:
+                self.forget(cache_key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, namespace, key, value):
+        cache_key = (namespace, str(key))
+        entry = (value, time.time())
+
+        with self.lock:
+            self.remember(cache_key, entry)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', cache_key + (json.dumps(value), entry[1]))
+                self.db.commit()
+
+    def get_or_fetch(self, namespace, key, fetch, ttl=None):
+        """ Returns the cached value, or calls fetch() and caches its result. None results are never cached.
+            ttl can shorten (never extend) how long entries of this kind stay fresh.
+        """
+        value = self.get(namespace, key, ttl)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.set(namespace, key, value)
+        return value
+
+    def remember(self, cache_key, entry):
+        self.entries[cache_key] = entry
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def forget(self, cache_key):
+        self.entries.pop(cache_key, None)
+        if self.db is not None:
+            self.db.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', cache_key)
+            self.db.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+
+import soundplow
+from controller import Controller, CONFIG_FILE, CLIENT_ID
+from log import Log
+
+# Settings and state all live under resources/, relative to the project folder. realpath so a symlink
+# to this file (e.g. ~/bin/soundplow) finds it too
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def read_urls(sources):
+    """ Every source is either a track url or a text file with one url per line. """
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source, 'r') as url_file:
+                for line in url_file:
+                    line = line.strip()
+                    if line != '' and not line.startswith('#'):
+                        yield line
+        else:
+            yield source
+
+def download(controller, args):
+    if args.queue:
+        # Goes through the job queue, so an interrupted run can be picked up again with just --queue
+        controller.queue_urls(read_urls(args.urls))
+        results = controller.download_queued(workers=args.workers)
+    elif len(args.urls) == 0:
+        Log.instance().error("No urls given! Pass some, or use --queue to download what is already queued.")
+        return 1
+    else:
+        results = controller.batch_download_urls(read_urls(args.urls), workers=args.workers)
+    return 1 if results[soundplow.DownloadResult.FAILED] > 0 else 0
+
+def search(controller, args):
+    results = controller.get_search_results(args.query, args.limit)
+    for number, track in enumerate(results, start=1):
+        print("{number}. {title} (id {track_id})".format(number=number, title=controller.get_track_name(track), track_id=track.id))
+
+    if args.download is not None:
+        if not 1 <= args.download <= len(results):
+            Log.instance().error("There is no search result number {number}!".format(number=args.download))
+            return 1
+        result = controller.download_track_by_id(results[args.download - 1].id)
+        return 0 if result is not soundplow.DownloadResult.FAILED else 1
+    return 0
+
+def watch_likes(controller, args):
+    controller.toggle_listen_for_likes(','.join(args.users))
+    if not controller.listening_for_likes:
+        return 1
+
+    try:
+        while controller.like_watcher.thread.is_alive():
+            controller.like_watcher.thread.join(1.0)
+    except KeyboardInterrupt:
+        controller.toggle_listen_for_likes(None)
+    return 0
+
+def backfill_likes(controller, args):
+    results = controller.backfill_likes(','.join(args.users), workers=args.workers)
+    return 1 if results[soundplow.DownloadResult.FAILED] > 0 else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='soundplow', description='Downloads songs from Soundcloud locally, without the UI.')
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, CONFIG_FILE), help='settings file (default: %(default)s)')
+    parser.add_argument('--client-id', default=os.path.join(ROOT_DIR, CLIENT_ID), help='file holding the Soundcloud client id (default: %(default)s)')
+    parser.add_argument('--output', help='folder to download into, overrides the settings file')
+    parser.add_argument('--log-file', help='also write the log to this file')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    download_parser = subparsers.add_parser('download', help='download track urls, or every url listed in the given files')
+    download_parser.add_argument('urls', nargs='*', metavar='URL_OR_FILE')
+    download_parser.add_argument('--workers', type=int, help='number of tracks downloaded at the same time')
+    download_parser.add_argument('--queue', action='store_true', help='add the urls to the job queue and download everything queued')
+    download_parser.set_defaults(run=download)
+
+    search_parser = subparsers.add_parser('search', help='search for tracks by name')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=5, help='number of results to show (default: %(default)s)')
+    search_parser.add_argument('--download', type=int, metavar='NUMBER', help='download the result with this number')
+    search_parser.set_defaults(run=search)
+
+    watch_parser = subparsers.add_parser('watch-likes', help='download everything the users like until interrupted')
+    watch_parser.add_argument('users', nargs='+', metavar='USER')
+    watch_parser.set_defaults(run=watch_likes)
+
+    backfill_parser = subparsers.add_parser('backfill-likes', help='download everything the users ever liked, resuming where the last run stopped')
+    backfill_parser.add_argument('users', nargs='+', metavar='USER')
+    backfill_parser.add_argument('--workers', type=int, help='number of tracks downloaded at the same time')
+    backfill_parser.set_defaults(run=backfill_likes)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Paths given on the command line are relative to where we were started, everything else to the project
+    for name in ('config', 'client_id', 'output', 'log_file'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if hasattr(args, 'urls'):
+        args.urls = [os.path.abspath(source) if os.path.isfile(source) else source for source in args.urls]
+    os.chdir(ROOT_DIR)
+
+    Log.instance().add_stream_sink(sys.stderr)
+    if args.log_file:
+        Log.instance().add_file_sink(args.log_file)
+
+    with open(args.client_id, 'r') as client_id_file:
+        client_id = client_id_file.read().strip()
+
+    # Same wiring as the UI, minus the UI
+    controller = Controller(args.config)
+    model = soundplow.Soundplow(client_id)
+    controller.set_model(model)
+    model.set_controller(controller)
+
+    controller.load()
+    if args.output:
+        model.set_output_path(args.output)
+    model.load()
+
+    try:
+        return args.run(controller, args)
+    finally:
+        controller.shutdown()
+
+if __name__ == '__main__':
+    sys.exit(main())
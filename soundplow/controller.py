@@ -1,100 +1,302 @@
 import sys
+import time
 import configparser
-from threading import Timer
+
+import requests
+from functools import partial
+from threading import Lock
 
 import soundplow
-from log import Log
+import network
+from cache import MetadataCache, DEFAULT_MAX_ENTRIES, DEFAULT_TTL
+from artwork import ArtworkCache, DEFAULT_ARTWORK_PATH, DEFAULT_ARTWORK_MAX_BYTES
+from dedup import DedupStore, DedupMode, DEDUP_FILE
+from likes import LikeTracker
+from watch import LikeWatcher, DEFAULT_WATCH_WORKERS, DEFAULT_LIKE_DOWNLOAD_WORKERS
+from jobs import JobQueue, JobState, JOBS_FILE, DEFAULT_MAX_ATTEMPTS
+from pipeline import Pipeline, Stage
+from throttle import Priority
+from log import Log, DEFAULT_MAX_LINES
+from metrics import Metrics, MetricsExporter, DEFAULT_STATS_INTERVAL
 
 DEFAULT_OUTPUT = r'D:\Music'
 DEFAULT_LIKE_CHECK_INTERVAL = 1.0
-DEFAULT_MAX_LIKE_CHECK = 10
+DEFAULT_MAX_LIKE_CHECK_INTERVAL = 60.0
+DEFAULT_LIKE_CHECK_BACKOFF = 2.0
+DEFAULT_LIKE_CHECK_JITTER = 0.1
+DEFAULT_MAX_LIKE_CHECK = 50
 DEFAULT_SEARCH_RESULTS = 5
+DEFAULT_BATCH_WORKERS = 8
+DEFAULT_RESOLVE_WORKERS = 16
+DEFAULT_METADATA_WORKERS = 8
 
 CONFIG_FILE = 'resources/settings.ini'
+CLIENT_ID = 'resources/secret.txt'
 
-class Repeater(object):
-    def __init__(self, interval, event):
-        self.interval = interval
-        self.event = event
-        self.timer = Timer(self.interval, self.handle_event)
-
-    def handle_event(self):
-        self.event()
-        self.start()
-
-    def start(self):
-        del self.timer
-        self.timer = Timer(self.interval, self.handle_event)
-        self.timer.start()
+class BatchDownload(object):
+    """ The pipeline stages of one batch_download_urls call, working on soundplow.DownloadJob items. """
+    def __init__(self, model, listener=None, cancel=None, job_queue=None):
+        self.model = model
+        self.listener = listener
+        self.cancel = cancel
+        self.job_queue = job_queue
+        self.results = {result: 0 for result in soundplow.DownloadResult}
+        self.seen_ids = set()
+        self.lock = Lock()
+
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    def set_state(self, job, state):
+        if self.job_queue is not None and job.job_id is not None:
+            self.job_queue.set_state(job.job_id, state, job.track_id)
+
+    def resolve(self, job):
+        if self.cancelled():
+            return soundplow.DownloadResult.CANCELLED
+
+        # Jobs that start out from a track id have nothing to resolve
+        if job.track_id is None:
+            self.set_state(job, JobState.RESOLVING)
+            job.track_id = self.model.resolve_track_id(job.url)
+            if job.track_id is None:
+                return soundplow.DownloadResult.FAILED
+
+        # Different urls can point at the same track
+        with self.lock:
+            if job.track_id in self.seen_ids:
+                return soundplow.DownloadResult.SKIPPED
+            self.seen_ids.add(job.track_id)
+
+        return self.model.check_library(job)
+
+    def prepare(self, job):
+        if self.cancelled():
+            return soundplow.DownloadResult.CANCELLED
+        return self.model.prepare_download(job)
+
+    def transfer(self, job):
+        if self.cancelled():
+            return soundplow.DownloadResult.CANCELLED
+
+        self.set_state(job, JobState.DOWNLOADING)
+        if self.listener is None:
+            return self.model.transfer_download(job, cancel=self.cancel)
+
+        job.cancel = self.listener.track_started(job.key)
+        job.progress = partial(self.listener.track_progress, job.key)
+        return self.model.transfer_download(job, job.progress, job.cancel)
+
+    def tag(self, job):
+        return self.model.finish_download(job)
+
+    def finished(self, job, result, error=None):
+        self.model.release_path(job)
+        with self.lock:
+            self.results[result] += 1
+        if self.listener is not None and job.cancel is not None:
+            self.listener.track_finished(job.key, result)
+
+        if self.job_queue is not None and job.job_id is not None:
+            if result == soundplow.DownloadResult.FAILED:
+                self.job_queue.fail(job.job_id, error or "download failed")
+            elif result == soundplow.DownloadResult.CANCELLED:
+                self.job_queue.set_state(job.job_id, JobState.QUEUED)
+            else:
+                self.job_queue.set_state(job.job_id, JobState.DONE)
 
-    def stop(self):
-        self.timer.cancel()
+    def failed(self, job, error):
+        Log.instance().error("Song failed: {key} ({error})".format(key=job.key, error=error))
+        self.finished(job, soundplow.DownloadResult.FAILED, error)
 
 class Controller(object):
-    def __init__(self):
+    def __init__(self, config_file=CONFIG_FILE):
         self.ui = None
+        self.config_file = config_file
         self.listening_for_likes = False
-        self.previous_likes = None
-        self.like_listener = Repeater(DEFAULT_LIKE_CHECK_INTERVAL, lambda: self.download_new_likes(self.model.get_last_liked()))
+        self.like_tracker = LikeTracker()
+        self.like_window = DEFAULT_MAX_LIKE_CHECK
+        self.batch_workers = DEFAULT_BATCH_WORKERS
+        self.resolve_workers = DEFAULT_RESOLVE_WORKERS
+        self.metadata_workers = DEFAULT_METADATA_WORKERS
+        self.pipeline = None
+        self.metrics_exporter = None
+        self.job_queue = None
+        self.like_watcher = LikeWatcher(self.check_likes, self.download_like, min_interval=DEFAULT_LIKE_CHECK_INTERVAL,
+                                        max_interval=DEFAULT_MAX_LIKE_CHECK_INTERVAL, backoff=DEFAULT_LIKE_CHECK_BACKOFF,
+                                        jitter=DEFAULT_LIKE_CHECK_JITTER)
 
     def load(self):
         self.load_settings()
 
     def load_settings(self):
         config = configparser.ConfigParser()
-        config.read(CONFIG_FILE)
+        config.read(self.config_file)
 
-        if 'general' in config:
-            if 'output' in config['general']:
-                self.ui.output_textbox.set_text(config['general']['output'])
-            else:
-                config['general']['output'] = DEFAULT_OUTPUT
-        else:
+        if 'general' not in config:
             config['general'] = {}
+        if 'output' not in config['general']:
             config['general']['output'] = DEFAULT_OUTPUT
+        self.model.set_output_path(config['general']['output'])
+        if self.ui is not None:
+            self.ui.output_textbox.set_text(config['general']['output'])
 
-        if 'like' in config and 'like' in self.ui.tabs:
-            if 'user' in config['like']:
-                self.ui.tabs['like'].textbox.set_text(config['like']['user'])
-            else:
-                config['like']['user'] = ''
+        if 'workers' in config['general']:
+            self.batch_workers = max(1, config['general'].getint('workers', DEFAULT_BATCH_WORKERS))
         else:
+            config['general']['workers'] = str(DEFAULT_BATCH_WORKERS)
+
+        if 'pipeline' not in config:
+            config['pipeline'] = {}
+        self.resolve_workers = max(1, config['pipeline'].getint('resolvers', DEFAULT_RESOLVE_WORKERS))
+        self.metadata_workers = max(1, config['pipeline'].getint('metadata', DEFAULT_METADATA_WORKERS))
+        config['pipeline']['resolvers'] = str(self.resolve_workers)
+        config['pipeline']['metadata'] = str(self.metadata_workers)
+
+        if 'log' not in config:
+            config['log'] = {}
+        log_settings = config['log']
+        log_file = log_settings.get('file', '')
+        json_lines = log_settings.getboolean('json', False)
+        max_lines = log_settings.getint('max_lines', DEFAULT_MAX_LINES)
+        log_settings['file'] = log_file
+        log_settings['json'] = str(json_lines).lower()
+        log_settings['max_lines'] = str(max_lines)
+        Log.instance().set_max_lines(max_lines)
+        if log_file:
+            Log.instance().add_file_sink(log_file, json_lines)
+
+        if 'network' not in config:
+            config['network'] = {}
+        network_settings = config['network']
+        pool_size = network_settings.getint('pool_size', network.DEFAULT_POOL_SIZE)
+        retries = network_settings.getint('retries', network.DEFAULT_RETRIES)
+        backoff = network_settings.getfloat('backoff', network.DEFAULT_BACKOFF)
+        max_concurrency = max(1, network_settings.getint('max_concurrency', pool_size))
+        network_settings['pool_size'] = str(pool_size)
+        network_settings['retries'] = str(retries)
+        network_settings['backoff'] = str(backoff)
+        network_settings['max_concurrency'] = str(max_concurrency)
+        self.model.session.configure(pool_size, retries, backoff, max_concurrency)
+
+        if 'bandwidth' not in config:
+            config['bandwidth'] = {}
+        bandwidth_settings = config['bandwidth']
+        total_kbs = max(0, bandwidth_settings.getint('total_kbs', 0))
+        per_download_kbs = max(0, bandwidth_settings.getint('per_download_kbs', 0))
+        bandwidth_settings['total_kbs'] = str(total_kbs)
+        bandwidth_settings['per_download_kbs'] = str(per_download_kbs)
+        self.model.bandwidth.configure(total_kbs * 1024, per_download_kbs * 1024)
+
+        if 'cache' not in config:
+            config['cache'] = {}
+        cache_settings = config['cache']
+        cache_path = cache_settings.get('path', '')
+        max_entries = cache_settings.getint('max_entries', DEFAULT_MAX_ENTRIES)
+        ttl = cache_settings.getint('ttl', DEFAULT_TTL)
+        cache_settings['path'] = cache_path
+        cache_settings['max_entries'] = str(max_entries)
+        cache_settings['ttl'] = str(ttl)
+        self.model.set_cache(MetadataCache(max_entries, ttl, cache_path or None))
+
+        if 'artwork' not in config:
+            config['artwork'] = {}
+        artwork_settings = config['artwork']
+        artwork_path = artwork_settings.get('path', DEFAULT_ARTWORK_PATH)
+        artwork_max_mb = artwork_settings.getint('max_mb', DEFAULT_ARTWORK_MAX_BYTES // (1024 * 1024))
+        artwork_settings['path'] = artwork_path
+        artwork_settings['max_mb'] = str(artwork_max_mb)
+        self.model.set_artwork_cache(ArtworkCache(self.model.fetch_artwork, artwork_path, artwork_max_mb * 1024 * 1024))
+
+        if 'dedup' not in config:
+            config['dedup'] = {}
+        dedup_settings = config['dedup']
+        dedup_path = dedup_settings.get('path', DEDUP_FILE)
+        try:
+            dedup_mode = DedupMode(dedup_settings.get('mode', DedupMode.LINK.value).strip().lower())
+        except ValueError:
+            Log.instance().warning("Unknown dedup mode \"{mode}\", expected one of {modes}.".format(
+                mode=dedup_settings.get('mode'), modes=', '.join(mode.value for mode in DedupMode)))
+            dedup_mode = DedupMode.LINK
+        dedup_settings['path'] = dedup_path
+        dedup_settings['mode'] = dedup_mode.value
+        self.model.set_dedup(DedupStore(dedup_path, dedup_mode))
+
+        if 'metrics' not in config:
+            config['metrics'] = {}
+        metrics_settings = config['metrics']
+        metrics_port = metrics_settings.getint('port', 0)
+        stats_file = metrics_settings.get('file', '')
+        stats_interval = metrics_settings.getfloat('interval', DEFAULT_STATS_INTERVAL)
+        metrics_settings['port'] = str(metrics_port)
+        metrics_settings['file'] = stats_file
+        metrics_settings['interval'] = str(stats_interval)
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        self.metrics_exporter = MetricsExporter(metrics_port, stats_file or None, stats_interval)
+        try:
+            self.metrics_exporter.start()
+        except OSError as e:
+            Log.instance().warning("Could not serve metrics on port {port}: {error}".format(port=metrics_port, error=e))
+
+        if 'like' not in config:
             config['like'] = {}
-            config['like']['user'] = ''
-
-        if 'link' in config and 'link' in self.ui.tabs:
+        like_settings = config['like']
+        # A single watched user used to be kept under 'user'
+        if 'users' not in like_settings:
+            like_settings['users'] = like_settings.get('user', '')
+        like_settings.pop('user', None)
+        if self.has_tab('like'):
+            self.ui.tabs['like'].textbox.set_text(like_settings['users'])
+
+        self.like_watcher.min_interval = like_settings.getfloat('min_interval', DEFAULT_LIKE_CHECK_INTERVAL)
+        self.like_watcher.max_interval = like_settings.getfloat('max_interval', DEFAULT_MAX_LIKE_CHECK_INTERVAL)
+        self.like_watcher.workers = max(1, like_settings.getint('workers', DEFAULT_WATCH_WORKERS))
+        self.like_watcher.download_workers = max(1, like_settings.getint('download_workers', DEFAULT_LIKE_DOWNLOAD_WORKERS))
+        self.like_window = like_settings.getint('window', DEFAULT_MAX_LIKE_CHECK)
+        like_settings['min_interval'] = str(self.like_watcher.min_interval)
+        like_settings['max_interval'] = str(self.like_watcher.max_interval)
+        like_settings['workers'] = str(self.like_watcher.workers)
+        like_settings['download_workers'] = str(self.like_watcher.download_workers)
+        like_settings['window'] = str(self.like_window)
+
+        if 'jobs' not in config:
+            config['jobs'] = {}
+        jobs_settings = config['jobs']
+        jobs_path = jobs_settings.get('path', JOBS_FILE)
+        max_attempts = max(1, jobs_settings.getint('max_attempts', DEFAULT_MAX_ATTEMPTS))
+        jobs_settings['path'] = jobs_path
+        jobs_settings['max_attempts'] = str(max_attempts)
+        if self.job_queue is not None:
+            self.job_queue.close()
+        self.job_queue = JobQueue(jobs_path, max_attempts)
+
+        # Links used to be kept in the settings file, move any that are left into the job queue
+        if 'link' in config:
             if 'tracks' in config['link']:
-                tracks = config['link']['tracks'].split(',')
-                for track in tracks:
-                    if track is not '':
-                        self.ui.track_list.add_item(track)
-            else:
-                config['link']['tracks'] = ''
-        else:
-            config['link'] = {}
-            config['link']['tracks'] = ''
+                self.job_queue.add([track for track in config['link']['tracks'].split(',') if track != ''])
+            del config['link']
+        if self.has_tab('link'):
+            self.ui.track_list.set_items(self.job_queue.outstanding())
 
-        with open(CONFIG_FILE, 'w') as config_file:
+        with open(self.config_file, 'w') as config_file:
             config.write(config_file)
 
     def save_settings(self):
+        # Running headless there is nothing the user could have changed
+        if self.ui is None:
+            return
+
         config = configparser.ConfigParser()
-        config.read(CONFIG_FILE)
+        config.read(self.config_file)
 
         config['general']['output'] = self.ui.output_textbox.get_text()
+        config['general']['workers'] = str(self.batch_workers)
 
         if 'like' in self.ui.tabs:
-            config['like']['user'] = self.ui.tabs['like'].textbox.get_text()
-
-        if 'link' in self.ui.tabs:
-            tracks = ''
-            for track in self.ui.track_list.get_items():
-                tracks = tracks + track + ','
-            if len(tracks) > 0 and tracks[-1] is ',':
-                tracks = tracks[:-1]
-            config['link']['tracks'] = tracks
+            config['like']['users'] = self.ui.tabs['like'].textbox.get_text()
 
-        with open(CONFIG_FILE, 'w') as config_file:
+        with open(self.config_file, 'w') as config_file:
             config.write(config_file)
 
     def set_ui(self, ui):
@@ -103,74 +305,228 @@ class Controller(object):
     def set_model(self, model):
         self.model = model
 
+    def has_tab(self, name):
+        return self.ui is not None and name in self.ui.tabs
+
     def log(self, text):
         self.ui.log.log(text)
 
     def close_app(self, return_value=0):
-        self.like_listener.stop()
-
         self.save_settings()
+        self.shutdown()
 
         sys.exit(return_value)
 
-    def download_track_by_id(self, track_id):
-        self.model.download_by_id(track_id)
+    def shutdown(self):
+        self.like_watcher.stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+
+        self.model.cache.close()
+        self.model.artwork.close()
+        self.model.dedup.close()
+        self.job_queue.close()
+        self.model.library.close()
+        self.model.session.close()
+
+    def download_track_by_id(self, track_id, listener=None):
+        return self.run_download(track_id, self.model.download_by_id, listener)
+
+    def run_download(self, key, download, listener=None, cancel=None):
+        """ Runs download(key) and reports it to listener, an object with track_started(key) -> threading.Event,
+            track_progress(key, received, total) and track_finished(key, result) that may be called from any thread.
+            The event returned by track_started cancels just this track, cancel stops it from starting at all.
+        """
+        if cancel is not None and cancel.is_set():
+            return soundplow.DownloadResult.CANCELLED
+        if listener is None:
+            return download(key, cancel=cancel)
+
+        result = soundplow.DownloadResult.FAILED
+        track_cancel = listener.track_started(key)
+        try:
+            result = download(key, progress=partial(listener.track_progress, key), cancel=track_cancel)
+        finally:
+            listener.track_finished(key, result)
+        return result
+
+    def queue_urls(self, urls):
+        """ Adds urls to the durable job queue, returns how many were queued. """
+        return self.job_queue.add(urls)
+
+    def remove_queued_urls(self, urls):
+        self.job_queue.remove(urls)
+
+    def queued_urls(self):
+        return self.job_queue.outstanding()
+
+    def download_queued(self, workers=None, listener=None, cancel=None):
+        """ Runs every queued job through batch_download_urls, recording each job's progress in the job queue
+            so a batch that gets interrupted picks up where it stopped.
+        """
+        jobs = (soundplow.DownloadJob(None, url, job_id) for job_id, url in self.job_queue.pending())
+        results = self.batch_download_urls(jobs, workers, listener, cancel)
+
+        counts = self.job_queue.counts()
+        if counts[JobState.QUEUED] > 0 or counts[JobState.FAILED] > 0:
+            Log.instance().warning("{queued} jobs left queued for the next run, {failed} gave up after {attempts} attempts.".format(
+                queued=counts[JobState.QUEUED], failed=counts[JobState.FAILED], attempts=self.job_queue.max_attempts))
+        return results
 
-    def batch_download_urls(self, urls):
+    def batch_download_urls(self, urls, workers=None, listener=None, cancel=None):
+        """ Downloads urls through a pipeline: resolving, metadata/stream lookups, MP3 transfers (workers at a time)
+            and tagging each run on their own threads, so transfers start while later urls are still resolving.
+            urls may also hold soundplow.DownloadJob items, whose job_id is then kept up to date in the job queue.
+        """
+        workers = max(1, workers or self.batch_workers)
+        start = time.time()
+        start_bytes = Metrics.instance().counter_value('downloaded_bytes_total')
+        batch = BatchDownload(self.model, listener, cancel, self.job_queue)
+        self.pipeline = Pipeline([
+            Stage('resolve', batch.resolve, self.resolve_workers),
+            Stage('metadata', batch.prepare, self.metadata_workers),
+            Stage('download', batch.transfer, workers),
+            Stage('tag', batch.tag, 1),
+        ], batch.finished, batch.failed)
+        self.pipeline.start()
+
+        # Items can be coming straight out of the job queue, and put() blocks while the pipeline is backed up
         num_songs = 0
         for url in urls:
+            job = url if isinstance(url, soundplow.DownloadJob) else soundplow.DownloadJob(None, url)
+            job.priority = Priority.BATCH
             num_songs += 1
-            Log.instance().info("* Song {song_num}: {url}".format(song_num=num_songs, url=url))
-            self.model.download_by_url(url)
-
-        Log.instance().success("--- Operation complete, {num_songs} urls processed! ---".format(num_songs=num_songs))
-
-    def toggle_listen_for_likes(self, user):
-        if user is None or user is '':
-            Log.instance().error("No user entered!")
-            return
+            Log.instance().info("* Song {song_num}: {key}".format(song_num=num_songs, key=job.key))
+            self.pipeline.put(job)
+        self.pipeline.close()
+        self.pipeline.join()
+
+        results = batch.results
+        Log.instance().success("--- Operation complete, {num_songs} urls processed with {workers} workers: {downloaded} downloaded, {skipped} skipped, {failed} failed, {cancelled} cancelled! ---".format(
+            num_songs=num_songs, workers=workers,
+            downloaded=results[soundplow.DownloadResult.DOWNLOADED],
+            skipped=results[soundplow.DownloadResult.SKIPPED],
+            failed=results[soundplow.DownloadResult.FAILED],
+            cancelled=results[soundplow.DownloadResult.CANCELLED]))
+        Log.instance().info("Metadata cache: {hits} hits, {misses} misses ({rate:.0%} hit rate).".format(
+            hits=self.model.cache.hits, misses=self.model.cache.misses, rate=self.model.cache.hit_rate()))
+
+        elapsed = time.time() - start
+        downloaded_mb = (Metrics.instance().counter_value('downloaded_bytes_total') - start_bytes) / 1048576.0
+        Metrics.instance().observe('batch_seconds', elapsed)
+        Log.instance().info("Transferred {mb:.1f} MB in {seconds:.1f}s ({rate:.2f} MB/s, {tracks_per_second:.2f} urls/s).".format(
+            mb=downloaded_mb, seconds=elapsed, rate=downloaded_mb / elapsed if elapsed > 0 else 0.0,
+            tracks_per_second=num_songs / elapsed if elapsed > 0 else 0.0))
 
-        if self.model.get_user(user) is None:
-            return
+        return results
 
-        self.listening_for_likes = not self.listening_for_likes
-        self.ui.tabs['like'].button.toggle_text()
+    def pipeline_depths(self):
+        """ (stage name, queued items) for every stage of the running batch, empty when no batch is running. """
+        return self.pipeline.queue_depths() if self.pipeline is not None else []
 
+    def toggle_listen_for_likes(self, users):
+        """ Starts watching every user in users (a comma separated list of usernames), or stops watching. """
         if self.listening_for_likes:
-            self.model.set_user(user)
-            self.like_listener.start()
-
-            Log.instance().info("Started listening for likes from user: \"{user}\"".format(user=user))
-        else:
-            self.like_listener.stop()
+            self.listening_for_likes = False
+            if self.has_tab('like'):
+                self.ui.tabs['like'].button.toggle_text()
+            self.like_watcher.stop()
+            for user in self.like_watcher.watched():
+                self.like_watcher.remove(user.user_id)
+                Log.instance().info("Stopped listening for likes from user: \"{user}\"".format(user=user.username))
+            return
 
-            Log.instance().info("Stopped listening for likes from user: \"{user}\"".format(user=user))
+        usernames = [username.strip() for username in (users or '').split(',') if username.strip() != '']
+        if len(usernames) == 0:
+            Log.instance().error("No user entered!")
+            return
 
-    def download_new_likes(self, last_likes):
-        if last_likes is None or last_likes is []:
+        for username in usernames:
+            self.watch_user(username)
+        if len(self.like_watcher.watched()) == 0:
             return
 
-        if self.previous_likes is None:
-            self.previous_likes = last_likes
-        else:
-            difference = [track_id for track_id in last_likes if track_id not in self.previous_likes and last_likes.index(track_id) < DEFAULT_MAX_LIKE_CHECK]
-            if len(difference) > 0:
-                for track_id in difference:
-                    Log.instance().info("Liked song found: {name}, downloading now...".format(name=self.model.get_track_name(track_id)))
-                    self.model.download_by_id(track_id)
-            self.previous_likes = last_likes
-
-    def get_search_results(self, query, num_results=DEFAULT_SEARCH_RESULTS):
-        count = 0
-        results = []
-        for track in self.model.search_for_songs(query):
-            if track is None:
-                break
-            results.append(track)
-            count += 1
-            if count > DEFAULT_SEARCH_RESULTS:
-                break
+        self.listening_for_likes = True
+        if self.has_tab('like'):
+            self.ui.tabs['like'].button.toggle_text()
+        self.like_watcher.start()
+
+    def watch_user(self, username):
+        user = self.model.get_user(username)
+        if user is None:
+            return False
+        if not self.like_watcher.add(user.id, username):
+            return False
+
+        Log.instance().info("Started listening for likes from user: \"{user}\"".format(user=username))
+        if self.like_tracker.knows(user.id):
+            Log.instance().info("Catching up on likes of \"{user}\" since the last session...".format(user=username))
+        return True
+
+    def check_likes(self, user):
+        """ Polls one WatchedUser, queues their new likes for download and returns how many there were. """
+        last_likes, user.etag, retry_after = self.model.get_likes(user.user_id, self.like_window, user.etag)
+        user.defer(retry_after)
+        if last_likes is None:
+            return 0
+
+        new_likes = self.like_tracker.diff(user.user_id, last_likes[:self.like_window])
+        Metrics.instance().increment('likes_found_total', len(new_likes))
+        for track_id in new_likes:
+            self.like_watcher.enqueue(track_id)
+        return len(new_likes)
+
+    def backfill_likes(self, users, workers=None, listener=None, cancel=None):
+        """ Downloads everything the users (a comma separated list of usernames) ever liked, newest first, a page at
+            a time through batch_download_urls. Where each user got to is checkpointed after every page, so an
+            interrupted backfill carries on from there the next time. Returns the combined DownloadResult counts.
+        """
+        results = {result: 0 for result in soundplow.DownloadResult}
+        for username in [username.strip() for username in (users or '').split(',') if username.strip() != '']:
+            user = self.model.get_user(username)
+            if user is None:
+                continue
+
+            state = self.like_tracker.backfill(user.id)
+            cursor = state['next'] if state is not None and not state['done'] else None
+            if cursor is not None:
+                Log.instance().info("Resuming the backfill of likes of \"{user}\" where it stopped...".format(user=username))
+            else:
+                Log.instance().info("Backfilling every like of \"{user}\"...".format(user=username))
+
+            try:
+                for track_ids, next_page in self.model.iter_like_pages(user.id, cursor):
+                    # Tracks already on disk are skipped before they cost any requests
+                    missing = [track_id for track_id in track_ids if not self.model.library.contains(track_id)]
+                    results[soundplow.DownloadResult.SKIPPED] += len(track_ids) - len(missing)
+                    if len(missing) > 0:
+                        page_results = self.batch_download_urls((soundplow.DownloadJob(track_id) for track_id in missing), workers, listener, cancel)
+                        for result, count in page_results.items():
+                            results[result] += count
+
+                    # A page is only checkpointed once all of it has been through, failed tracks get another go on the next full run
+                    if cancel is not None and cancel.is_set():
+                        Log.instance().warning("Backfill of \"{user}\" stopped, it will resume from here.".format(user=username))
+                        return results
+                    self.like_tracker.set_backfill(user.id, next_page)
+            except requests.exceptions.RequestException as e:
+                Log.instance().error("Backfill of \"{user}\" stopped by a Soundcloud error, it will resume from here: {error}".format(user=username, error=e))
+                continue
+
+            Log.instance().success("Backfilled every like of \"{user}\".".format(user=username))
+
+        Log.instance().success("--- Backfill complete: {downloaded} downloaded, {skipped} already there, {failed} failed! ---".format(
+            downloaded=results[soundplow.DownloadResult.DOWNLOADED],
+            skipped=results[soundplow.DownloadResult.SKIPPED],
+            failed=results[soundplow.DownloadResult.FAILED]))
         return results
 
+    def download_like(self, track_id):
+        Log.instance().info("Liked song found: {name}, downloading now...".format(name=self.model.get_track_name(track_id)))
+        return self.model.download_by_id(track_id)
+
+    def get_search_results(self, query, num_results=DEFAULT_SEARCH_RESULTS, offset=0):
+        return list(self.model.search_for_songs(query, num_results, offset))
+
     def get_track_name(self, track):
         return soundplow.format_title(track)
@@ -0,0 +1,68 @@
+import os
+import hashlib
+import sqlite3
+from enum import Enum
+from threading import Lock
+
+from tagging import tag_size
+
+DEDUP_FILE = 'resources/dedup.sqlite'
+HASH_CHUNK_SIZE = 1024 * 1024
+ID3V1_SIZE = 128
+
+class DedupMode(Enum):
+    OFF = 'off'
+    LINK = 'link'   # replace the new copy with a hardlink to the one we already have
+    SKIP = 'skip'   # delete the new copy and point the library at the old one
+
+def audio_hash(path):
+    """ sha1 of the audio frames only, leaving out the ID3v2 tag at the start and an ID3v1 tag at the end,
+        so the same upload hashes the same whatever title, artwork or track id it got tagged with.
+    """
+    size = os.path.getsize(path)
+    start = tag_size(path)
+    with open(path, 'rb') as f:
+        if size - start >= ID3V1_SIZE:
+            f.seek(size - ID3V1_SIZE)
+            if f.read(3) == b'TAG':
+                size -= ID3V1_SIZE
+
+        digest = hashlib.sha1()
+        f.seek(start)
+        remaining = size - start
+        while remaining > 0:
+            chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+class DedupStore(object):
+    """ Maps audio hashes to the first file downloaded with that audio, across every output folder.
+        Lives in its own SQLite file, unlike the per-folder Library, so re-uploads and the same track
+        downloaded into another folder are recognised too.
+    """
+    def __init__(self, path=DEDUP_FILE, mode=DedupMode.LINK):
+        self.path = path
+        self.mode = mode
+        self.lock = Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS audio (hash TEXT PRIMARY KEY, path TEXT)')
+        self.db.commit()
+
+    def claim(self, audio_hash, path):
+        """ Records path as the copy of this audio, returns the path of the copy we already had or None. """
+        with self.lock:
+            row = self.db.execute('SELECT path FROM audio WHERE hash = ?', (audio_hash,)).fetchone()
+            # If the old copy was deleted or moved away, the new one takes its place
+            if row is not None and row[0] != path and os.path.isfile(row[0]):
+                return row[0]
+            self.db.execute('INSERT OR REPLACE INTO audio VALUES (?, ?)', (audio_hash, path))
+            self.db.commit()
+        return None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,105 @@
+import time
+import sqlite3
+from enum import Enum
+from threading import Lock
+
+JOBS_FILE = 'resources/jobs.sqlite'
+DEFAULT_MAX_ATTEMPTS = 3
+PAGE_SIZE = 500
+
+class JobState(Enum):
+    QUEUED = 'queued'
+    RESOLVING = 'resolving'
+    DOWNLOADING = 'downloading'
+    DONE = 'done'
+    FAILED = 'failed'
+
+ACTIVE_STATES = (JobState.RESOLVING.value, JobState.DOWNLOADING.value)
+
+class JobQueue(object):
+    """ Durable queue of track urls waiting to be downloaded, kept in SQLite (WAL mode) so every state change
+        is on disk as soon as it happens. Jobs that were in flight when the app stopped are queued again on
+        the next start, failed jobs are retried until they have used up max_attempts.
+    """
+    def __init__(self, path=JOBS_FILE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, state TEXT, '
+                        'track_id TEXT, attempts INTEGER, error TEXT, created REAL, updated REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+
+        # Whatever was running when we last stopped never finished
+        self.db.execute('UPDATE jobs SET state = ? WHERE state IN (?, ?)', (JobState.QUEUED.value,) + ACTIVE_STATES)
+        self.db.commit()
+
+    def add(self, urls):
+        """ Queues urls, returns how many were queued. Urls that already finished (or gave up) are queued again,
+            ones that are still waiting are left alone.
+        """
+        now = time.time()
+        added = 0
+        with self.lock:
+            for url in urls:
+                cursor = self.db.execute('INSERT OR IGNORE INTO jobs (url, state, attempts, created, updated) VALUES (?, ?, 0, ?, ?)',
+                                         (url, JobState.QUEUED.value, now, now))
+                if cursor.rowcount == 0:
+                    cursor = self.db.execute('UPDATE jobs SET state = ?, attempts = 0, error = NULL, updated = ? WHERE url = ? AND state IN (?, ?)',
+                                             (JobState.QUEUED.value, now, url, JobState.DONE.value, JobState.FAILED.value))
+                added += cursor.rowcount
+            self.db.commit()
+        return added
+
+    def remove(self, urls):
+        with self.lock:
+            self.db.executemany('DELETE FROM jobs WHERE url = ?', ((url,) for url in urls))
+            self.db.commit()
+
+    def pending(self):
+        """ Yields (job id, url) for every queued job, oldest first. Reads a page at a time so huge queues
+            don't have to fit in memory, jobs queued again while this runs are left for the next call.
+        """
+        last_id = 0
+        while True:
+            with self.lock:
+                page = self.db.execute('SELECT id, url FROM jobs WHERE state = ? AND id > ? ORDER BY id LIMIT ?',
+                                       (JobState.QUEUED.value, last_id, PAGE_SIZE)).fetchall()
+            if len(page) == 0:
+                return
+            for job_id, url in page:
+                yield job_id, url
+            last_id = page[-1][0]
+
+    def outstanding(self):
+        """ Urls of every job that isn't done, oldest first. """
+        with self.lock:
+            return [url for url, in self.db.execute('SELECT url FROM jobs WHERE state != ? ORDER BY id', (JobState.DONE.value,))]
+
+    def set_state(self, job_id, state, track_id=None):
+        with self.lock:
+            self.db.execute('UPDATE jobs SET state = ?, track_id = COALESCE(?, track_id), updated = ? WHERE id = ?',
+                            (state.value, None if track_id is None else str(track_id), time.time(), job_id))
+            self.db.commit()
+
+    def fail(self, job_id, error):
+        """ Counts a failed attempt, queuing the job again if it has attempts left. Returns the job's new state. """
+        with self.lock:
+            attempts, = self.db.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone() or (self.max_attempts,)
+            state = JobState.QUEUED if attempts + 1 < self.max_attempts else JobState.FAILED
+            self.db.execute('UPDATE jobs SET state = ?, attempts = ?, error = ?, updated = ? WHERE id = ?',
+                            (state.value, attempts + 1, str(error), time.time(), job_id))
+            self.db.commit()
+        return state
+
+    def counts(self):
+        with self.lock:
+            counts = dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+        return {state: counts.get(state.value, 0) for state in JobState}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
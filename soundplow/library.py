@@ -0,0 +1,102 @@
+import os
+import sqlite3
+from threading import Lock
+
+from log import Log
+from tagging import TRACK_ID_TAG
+
+LIBRARY_FILE = '.soundplow_library.sqlite'
+
+def read_track_id(path):
+    from mutagen.id3 import ID3, ID3NoHeaderError
+
+    try:
+        frame = ID3(path).get('TXXX:' + TRACK_ID_TAG)
+    except ID3NoHeaderError:
+        return None
+    return str(frame.text[0]) if frame is not None and frame.text else None
+
+class Library(object):
+    """ Index of the tracks already downloaded into an output folder, keyed by SoundCloud track id.
+        The index lives in a small SQLite file inside the folder. It is built from the files' ID3 tags
+        the first time the folder is seen and updated as tracks are added afterwards.
+        Only the tags are read while scanning, file contents are never hashed here, so opening a big folder stays quick.
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.tracks = {}
+        self.lock = Lock()
+
+        self.db = sqlite3.connect(os.path.join(output_path, LIBRARY_FILE), check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS tracks (track_id TEXT PRIMARY KEY, path TEXT, size INTEGER, hash TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+
+        for track_id, path, size, file_hash in self.db.execute('SELECT track_id, path, size, hash FROM tracks'):
+            self.tracks[track_id] = (path, size, file_hash)
+
+        # Only a scan that got to the end counts, one that crashed or got killed halfway is done again
+        if self.db.execute("SELECT value FROM meta WHERE key = 'scanned'").fetchone() is None:
+            self.scan()
+            with self.lock:
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('scanned', '1')")
+                self.db.commit()
+
+    def scan(self):
+        """ Indexes every tagged MP3 in the output folder that isn't indexed yet. Returns how many were added. """
+        from mutagen import MutagenError
+
+        with self.lock:
+            known_paths = set(entry[0] for entry in self.tracks.values())
+
+        added = 0
+        for root, dirs, files in os.walk(self.output_path):
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.lower().endswith('.mp3') or path in known_paths:
+                    continue
+
+                # One broken file shouldn't keep the rest of the folder out of the index
+                try:
+                    track_id = read_track_id(path)
+                except (MutagenError, OSError) as e:
+                    Log.instance().warning("Could not read the tags of {path}, leaving it out of the library: {error}".format(path=path, error=e))
+                    continue
+                if track_id is not None:
+                    self.add(track_id, path)
+                    added += 1
+        return added
+
+    def add(self, track_id, path, file_hash=None):
+        entry = (path, os.path.getsize(path), file_hash)
+        with self.lock:
+            self.tracks[str(track_id)] = entry
+            self.db.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)', (str(track_id),) + entry)
+            self.db.commit()
+
+    def remove(self, track_id):
+        with self.lock:
+            self.tracks.pop(str(track_id), None)
+            self.db.execute('DELETE FROM tracks WHERE track_id = ?', (str(track_id),))
+            self.db.commit()
+
+    def get(self, track_id):
+        with self.lock:
+            return self.tracks.get(str(track_id))
+
+    def contains(self, track_id):
+        entry = self.get(track_id)
+        if entry is None:
+            return False
+
+        # The file was deleted or moved away behind our back, forget it so it can be downloaded again
+        if not os.path.isfile(entry[0]):
+            self.remove(track_id)
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def close(self):
+        self.db.close()
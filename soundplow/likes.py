@@ -0,0 +1,83 @@
+import os
+import json
+from threading import Lock
+
+LIKES_FILE = 'resources/likes.json'
+
+class LikeTracker(object):
+    """ Works out which likes are new since the last check, per user.
+        For each user we keep the newest like we've seen (the cursor) and the set of ids in the last window.
+        Everything above the first like we already know (the cursor, or any id in that set) is new.
+        The state is saved to a JSON file so likes made while the app was closed get picked up on the next check.
+    """
+    def __init__(self, path=LIKES_FILE):
+        self.path = path
+        self.lock = Lock()
+        self.cursors = {}
+        self.seen = {}
+        self.backfills = {}     # user id -> {'next': url of the next page of the like history, 'done': bool}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for user_id, state in json.load(f).items():
+                    if 'cursor' in state:
+                        self.cursors[user_id] = state['cursor']
+                        self.seen[user_id] = set(state['seen'])
+                    if 'backfill' in state:
+                        self.backfills[user_id] = state['backfill']
+
+    def knows(self, user_id):
+        return str(user_id) in self.cursors
+
+    def diff(self, user_id, likes):
+        """ Takes the newest-first window of like ids and returns the new ones, oldest first.
+            The first call for a user only records where we start from and returns nothing.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            if user_id not in self.cursors:
+                new_likes = []
+            else:
+                cursor = self.cursors[user_id]
+                seen = self.seen[user_id]
+                new_likes = []
+                # New likes are always at the top, so the first one we know ends them. Stopping only at the cursor
+                # would run to the end of the window when it got unliked, and pass off old likes as new
+                for track_id in likes:
+                    if track_id == cursor or track_id in seen:
+                        break
+                    new_likes.append(track_id)
+                new_likes.reverse()
+
+            cursor = likes[0] if likes else self.cursors.get(user_id)
+            seen = set(likes)
+            # With many users watched most polls change nothing, so only write when something did
+            if user_id not in self.cursors or cursor != self.cursors[user_id] or seen != self.seen[user_id]:
+                self.cursors[user_id] = cursor
+                self.seen[user_id] = seen
+                self.save()
+
+        return new_likes
+
+    def backfill(self, user_id):
+        """ Where the user's like history backfill got to, None if it never started. """
+        with self.lock:
+            state = self.backfills.get(str(user_id))
+            return dict(state) if state is not None else None
+
+    def set_backfill(self, user_id, next_page):
+        """ Checkpoints the backfill, next_page being None once the whole history is done. """
+        with self.lock:
+            self.backfills[str(user_id)] = {'next': next_page, 'done': next_page is None}
+            self.save()
+
+    def save(self):
+        state = {}
+        for user_id in self.cursors:
+            state[user_id] = {'cursor': self.cursors[user_id], 'seen': sorted(self.seen[user_id], key=str)}
+        for user_id, backfill in self.backfills.items():
+            state.setdefault(user_id, {})['backfill'] = backfill
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,40 @@
+import re
+
+# soundcloud.com/user/track, with the s-... token of a secret share link if there is one
+TRACK_LINK_PATTERN = re.compile(r'^(?:https?://)?(?:www\.|m\.)?soundcloud\.com/([^/?#\s]+)/([^/?#\s]+)(/s-[^/?#\s]+)?/?(?:[?#]\S*)?$', re.IGNORECASE)
+SHORT_LINK_PATTERN = re.compile(r'^(?:https?://)?on\.soundcloud\.com/([^/?#\s]+)/?(?:[?#]\S*)?$', re.IGNORECASE)
+SEPARATOR_PATTERN = re.compile(r'[\s,]+')
+
+def normalize_link(text):
+    """ Canonical form of a track link (or None if it isn't one), so the same track pasted with a different
+        scheme, host, trailing slash or query string is only queued once. The path keeps its case,
+        secret tokens and short link codes are case sensitive.
+    """
+    text = text.strip()
+    match = TRACK_LINK_PATTERN.match(text)
+    if match is not None:
+        return 'https://soundcloud.com/{user}/{track}{secret}'.format(user=match.group(1), track=match.group(2), secret=match.group(3) or '')
+
+    match = SHORT_LINK_PATTERN.match(text)
+    if match is not None:
+        return 'https://on.soundcloud.com/{code}'.format(code=match.group(1))
+    return None
+
+def parse_links(text):
+    """ Splits pasted text or a file's contents on whitespace and commas.
+        Returns the normalized track links, in order, and how many other entries were found.
+    """
+    links = []
+    invalid = 0
+    for line in text.splitlines():
+        if line.lstrip().startswith('#'):
+            continue
+        for entry in SEPARATOR_PATTERN.split(line):
+            if entry == '':
+                continue
+            link = normalize_link(entry)
+            if link is None:
+                invalid += 1
+            else:
+                links.append(link)
+    return links, invalid
@@ -1,39 +1,112 @@
-from singleton import Singleton
+import json
+import logging
+import logging.handlers
+from collections import deque
 from enum import Enum
 
-from PySide2.QtGui import QTextCharFormat, QBrush, QColor
+from singleton import Singleton
 
 MessageType = Enum('MessageType', 'INFO WARNING ERROR SUCCESS')
 
+MESSAGE_COLORS = {
+    MessageType.INFO: "000000",
+    MessageType.WARNING: "#9ece2f",
+    MessageType.ERROR: "#ed2d2d",
+    MessageType.SUCCESS: "#4dd30a",
+}
+LOGGING_LEVELS = {
+    MessageType.INFO: logging.INFO,
+    MessageType.WARNING: logging.WARNING,
+    MessageType.ERROR: logging.ERROR,
+    MessageType.SUCCESS: logging.INFO,
+}
+
+DEFAULT_MAX_LINES = 5000
+FLUSH_INTERVAL_MS = 50
+DEFAULT_LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_LOG_FILE_BACKUPS = 3
+
 class UndefinedMessageType(RuntimeError):
     pass
 
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({'time': record.created, 'type': record.message_type, 'message': record.getMessage()})
+
 @Singleton
 class Log(object):
+    """ Can be called from any thread. Messages are queued and drawn into the text box in batches by a timer
+        on the GUI thread (at most 1000 / FLUSH_INTERVAL_MS times a second), and the text box only keeps the
+        last max_lines lines. Every message also goes to the file sinks straight away.
+    """
     def __init__(self):
-        pass
+        self.textbox = None
+        self.max_lines = DEFAULT_MAX_LINES
+        self.pending = deque(maxlen=self.max_lines)
+
+        self.logger = logging.getLogger('soundplow')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(logging.NullHandler())
+
+    def load(self, textbox, max_lines=DEFAULT_MAX_LINES):
+        # Imported here so the headless entry point never has to load Qt
+        from PySide2.QtCore import QTimer
 
-    def load(self, textbox):
         self.textbox = textbox
         self.text_cursor = self.textbox.textCursor()
+        self.set_max_lines(max_lines)
 
-    def log(self, text, level=MessageType.INFO):
-        if level is MessageType.INFO:
-            color = "000000"
-        elif level is MessageType.WARNING:
-            color = "#9ece2f"
-        elif level is MessageType.ERROR:
-            color = "#ed2d2d"
-        elif level is MessageType.SUCCESS:
-            color = "#4dd30a"
+        self.flush_timer = QTimer()
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(FLUSH_INTERVAL_MS)
+
+    def set_max_lines(self, max_lines):
+        self.max_lines = max_lines
+        self.pending = deque(self.pending, maxlen=max_lines)
+        if self.textbox is not None:
+            self.textbox.document().setMaximumBlockCount(max_lines)
+
+    def add_file_sink(self, path, json_lines=False, max_bytes=DEFAULT_LOG_FILE_MAX_BYTES, backups=DEFAULT_LOG_FILE_BACKUPS):
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        if json_lines:
+            handler.setFormatter(JsonLinesFormatter())
         else:
+            handler.setFormatter(logging.Formatter('%(asctime)s [%(message_type)s] %(message)s'))
+        self.logger.addHandler(handler)
+        return handler
+
+    def add_stream_sink(self, stream=None):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('[%(message_type)s] %(message)s'))
+        self.logger.addHandler(handler)
+        return handler
+
+    def log(self, text, level=MessageType.INFO):
+        if level not in MESSAGE_COLORS:
             raise UndefinedMessageType("Undefined message type: {type}.".format(type=level))
 
-        line_format = QTextCharFormat()
-        line_format.setForeground(QBrush(QColor(color)))
-        self.text_cursor.setCharFormat(line_format)
+        if self.textbox is not None:
+            self.pending.append((text, level))
+        self.logger.log(LOGGING_LEVELS[level], text, extra={'message_type': level.name})
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        from PySide2.QtGui import QTextCharFormat, QTextCursor, QBrush, QColor
+
+        self.text_cursor.beginEditBlock()
+        self.text_cursor.movePosition(QTextCursor.End)
+        while self.pending:
+            text, level = self.pending.popleft()
+
+            line_format = QTextCharFormat()
+            line_format.setForeground(QBrush(QColor(MESSAGE_COLORS[level])))
+            self.text_cursor.setCharFormat(line_format)
+            self.text_cursor.insertText(text + "\n")
+        self.text_cursor.endEditBlock()
 
-        self.text_cursor.insertText(text + "\n")
         self.textbox.verticalScrollBar().setValue(self.textbox.verticalScrollBar().maximum())
 
     def info(self, text):
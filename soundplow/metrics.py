@@ -0,0 +1,165 @@
+import os
+import time
+import functools
+from threading import Thread, Event, Lock
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from singleton import Singleton
+
+PREFIX = 'soundplow_'
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+DEFAULT_STATS_INTERVAL = 10.0
+
+def label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{key}="{value}"'.format(key=key, value=value) for key, value in labels) + '}'
+
+def timed(stage):
+    """ Decorator recording how long each call takes in the stage_seconds histogram. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Metrics.instance().timer('stage_seconds', stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@Singleton
+class Metrics(object):
+    """ Process wide counters, gauges and latency histograms, safe to update from any thread.
+        render() gives them in the Prometheus text format, summary() as a few human readable lines.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}      # name -> {labels: value}
+        self.histograms = {}    # name -> {labels: [bucket counts, sum, count]}
+        self.gauges = {}        # name -> function returning the current value
+
+    def increment(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {}).setdefault(key, [[0] * len(BUCKETS), 0.0, 0])
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def gauge(self, name, read):
+        with self.lock:
+            self.gauges[name] = read
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        with self.lock:
+            values = self.counters.get(name, {})
+            if labels:
+                return values.get(tuple(sorted(labels.items())), 0)
+            return sum(values.values())
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, values in sorted(self.counters.items()):
+                lines.append('# TYPE {prefix}{name} counter'.format(prefix=PREFIX, name=name))
+                for labels, value in sorted(values.items()):
+                    lines.append('{prefix}{name}{labels} {value}'.format(prefix=PREFIX, name=name, labels=label_text(labels), value=value))
+
+            for name, values in sorted(self.histograms.items()):
+                lines.append('# TYPE {prefix}{name} histogram'.format(prefix=PREFIX, name=name))
+                for labels, (buckets, total, count) in sorted(values.items()):
+                    for bound, bucket in zip(BUCKETS, buckets):
+                        bucket_labels = labels + (('le', '+Inf' if bound == float('inf') else bound),)
+                        lines.append('{prefix}{name}_bucket{labels} {value}'.format(prefix=PREFIX, name=name, labels=label_text(bucket_labels), value=bucket))
+                    lines.append('{prefix}{name}_sum{labels} {value}'.format(prefix=PREFIX, name=name, labels=label_text(labels), value=total))
+                    lines.append('{prefix}{name}_count{labels} {value}'.format(prefix=PREFIX, name=name, labels=label_text(labels), value=count))
+
+            gauges = sorted(self.gauges.items())
+        for name, read in gauges:
+            lines.append('# TYPE {prefix}{name} gauge'.format(prefix=PREFIX, name=name))
+            lines.append('{prefix}{name} {value}'.format(prefix=PREFIX, name=name, value=read()))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        lines = []
+        with self.lock:
+            stages = sorted(self.histograms.get('stage_seconds', {}).items())
+        for labels, (buckets, total, count) in stages:
+            lines.append("{stage}: {count} calls, {mean:.3f}s avg".format(stage=dict(labels)['stage'], count=count, mean=total / count if count else 0.0))
+
+        transfer_seconds = sum(histogram[1] for labels, histogram in stages if dict(labels)['stage'] == 'transfer')
+        downloaded = self.counter_value('downloaded_bytes_total')
+        if transfer_seconds > 0:
+            lines.append("transfers: {mb:.1f} MB at {rate:.2f} MB/s per download".format(mb=downloaded / 1048576.0, rate=downloaded / 1048576.0 / transfer_seconds))
+
+        lines.append("api requests: {requests}, retries: {retries}".format(requests=self.counter_value('api_requests_total'), retries=self.counter_value('retries_total')))
+        with self.lock:
+            hits = self.gauges.get('cache_hits')
+            misses = self.gauges.get('cache_misses')
+        if hits is not None and misses is not None and hits() + misses() > 0:
+            lines.append("cache hit rate: {rate:.0%}".format(rate=hits() / float(hits() + misses())))
+        return lines
+
+    def write_file(self, path):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as stats_file:
+            stats_file.write(self.render())
+        os.replace(temp_path, path)
+
+class MetricsExporter(object):
+    """ Serves Metrics.render() on http://host:port/metrics and/or rewrites it to a file every interval seconds. """
+    def __init__(self, port=0, path=None, interval=DEFAULT_STATS_INTERVAL, host='127.0.0.1'):
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.host = host
+        self.server = None
+        self.stopped = Event()
+
+    def start(self):
+        if self.port:
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(handler):
+                    body = Metrics.instance().render().encode()
+                    handler.send_response(200)
+                    handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    handler.send_header('Content-Length', str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+
+                def log_message(handler, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            Thread(target=self.server.serve_forever, daemon=True).start()
+
+        if self.path:
+            Thread(target=self.write_periodically, daemon=True).start()
+
+    def write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            Metrics.instance().write_file(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            Metrics.instance().write_file(self.path)
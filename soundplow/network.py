@@ -0,0 +1,181 @@
+import re
+import time
+from threading import Condition, Lock
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+
+import requests
+import soundcloud
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import Metrics
+
+API_HOST = 'https://api.soundcloud.com'
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 30
+RETRY_STATUSES = (500, 502, 503, 504)
+RATE_LIMITED = 429
+DEFAULT_RATE_LIMIT_WAIT = 2.0
+MAX_RATE_LIMIT_WAIT = 300.0
+AIMD_DECREASE = 0.5
+AIMD_COOLDOWN = 1.0
+ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+def endpoint_name(resource):
+    """ Metrics label for an API resource, with ids collapsed so /tracks/1 and /tracks/2 count together. """
+    return ID_PATTERN.sub('/{id}', urlparse(resource).path or '/')
+
+def parse_retry_after(value):
+    """ Retry-After is either a number of seconds or an HTTP date, returns seconds to wait (or None). """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CountingRetry(Retry):
+    """ Retry that counts every retry urllib3 makes on our behalf. """
+    def increment(self, *args, **kwargs):
+        Metrics.instance().increment('retries_total', kind='http')
+        return super(CountingRetry, self).increment(*args, **kwargs)
+
+class AimdLimiter(object):
+    """ Caps the requests in flight to one host. The cap grows by one for every cap's worth of requests that
+        go through and halves when the host answers 429 (at most once per AIMD_COOLDOWN, since a burst of them
+        is one signal), and no new request starts until any Retry-After has passed.
+    """
+    def __init__(self, max_limit, min_limit=1):
+        self.condition = Condition()
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+
+    def release(self, status=None, retry_after=None):
+        """ status is the response's status code, or None when the request never got one. """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.time()
+            if status == RATE_LIMITED:
+                if now - self.last_decrease > AIMD_COOLDOWN:
+                    self.limit = max(self.min_limit, self.limit * AIMD_DECREASE)
+                    self.last_decrease = now
+                self.paused_until = max(self.paused_until, now + min(retry_after or DEFAULT_RATE_LIMIT_WAIT, MAX_RATE_LIMIT_WAIT))
+            elif status is not None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+class HttpSession(object):
+    """ One keep-alive requests.Session shared by every network call the app makes.
+        Connections are pooled per host (at most pool_size open to a single host at a time)
+        and transient 5xx/connection errors are retried with exponential backoff.
+        Every host also gets an AimdLimiter shared by all callers, 429s are waited out and retried through it.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT):
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = soundcloud.USER_AGENT
+        self.timeout = timeout
+        self.limiters = {}
+        self.limiters_lock = Lock()
+        self.configure(pool_size, retries, backoff)
+
+    def configure(self, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_concurrency=None):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency or pool_size
+        with self.limiters_lock:
+            for limiter in self.limiters.values():
+                limiter.max_limit = self.max_concurrency
+                limiter.limit = min(limiter.limit, self.max_concurrency)
+
+        retry = CountingRetry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def limiter(self, host):
+        with self.limiters_lock:
+            if host not in self.limiters:
+                self.limiters[host] = AimdLimiter(self.max_concurrency)
+            return self.limiters[host]
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        limiter = self.limiter(urlparse(url).netloc)
+
+        for attempt in range(self.retries + 1):
+            limiter.acquire()
+            status = retry_after = None
+            try:
+                response = self.session.get(url, **kwargs)
+                status = response.status_code
+                if status == RATE_LIMITED:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after is None:
+                        retry_after = max(self.backoff, DEFAULT_RATE_LIMIT_WAIT) * 2 ** attempt
+            finally:
+                limiter.release(status, retry_after)
+
+            if status != RATE_LIMITED or attempt == self.retries:
+                return response
+            # The next acquire() waits out the Retry-After, along with every other request to this host
+            Metrics.instance().increment('rate_limited_total', host=urlparse(url).netloc)
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+class ApiClient(object):
+    """ Drop-in for the parts of soundcloud.Client we use, sending everything through a HttpSession. """
+    def __init__(self, session, client_id, host=API_HOST):
+        self.session = session
+        self.client_id = client_id
+        self.host = host
+
+        Metrics.instance().gauge('api_concurrency_limit', lambda: self.session.limiter(urlparse(self.host).netloc).limit)
+
+    def url(self, resource):
+        if resource.startswith('http'):
+            return resource
+        return '{host}/{resource}'.format(host=self.host, resource=resource.lstrip('/'))
+
+    def request(self, resource, headers=None, allow_redirects=True, **params):
+        params['client_id'] = self.client_id
+        request_headers = {'Accept': 'application/json'}
+        request_headers.update(headers or {})
+        response = self.session.get(self.url(resource), params=params, headers=request_headers, allow_redirects=allow_redirects)
+
+        Metrics.instance().increment('api_requests_total', endpoint=endpoint_name(resource), status=response.status_code)
+        return response
+
+    def get(self, resource, **params):
+        response = self.request(resource, **params)
+        response.raise_for_status()
+        return soundcloud.resource.wrapped_resource(response)
+
+    def get_json(self, resource, **params):
+        response = self.request(resource, **params)
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,87 @@
+from queue import Queue
+from threading import Thread, Lock
+
+from log import Log
+
+class Stage(object):
+    """ One step of a Pipeline: work(item) runs on `workers` threads fed from a queue holding at most `capacity` items.
+        work returns None to pass the item on to the next stage, anything else finishes the item with that result.
+    """
+    def __init__(self, name, work, workers=1, capacity=None):
+        self.name = name
+        self.work = work
+        self.workers = max(1, workers)
+        self.queue = Queue(maxsize=capacity if capacity is not None else self.workers * 2)
+        self.threads = []
+        self.running = 0
+        self.lock = Lock()
+
+class Pipeline(object):
+    """ Chains stages together through bounded queues. A full queue blocks the stage feeding it,
+        so a slow stage holds back everything before it (down to put()) instead of piling up items.
+    """
+    STOP = object()
+
+    def __init__(self, stages, on_result, on_error):
+        self.stages = stages
+        self.on_result = on_result
+        self.on_error = on_error
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            stage.running = stage.workers
+            for _ in range(stage.workers):
+                thread = Thread(target=self.run_stage, args=(index,), daemon=True)
+                stage.threads.append(thread)
+                thread.start()
+
+    def put(self, item):
+        self.stages[0].queue.put(item)
+
+    def close(self):
+        """ No more items are coming, stages shut down in order once they have drained. """
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(self.STOP)
+
+    def join(self):
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+
+    def queue_depths(self):
+        return [(stage.name, stage.queue.qsize()) for stage in self.stages]
+
+    def report(self, stage, callback, item, value):
+        # A worker that died here would never pass on the stop signal, leaving join() waiting forever
+        try:
+            callback(item, value)
+        except Exception as e:
+            Log.instance().error("Pipeline stage \"{stage}\" could not report an item: {error}".format(stage=stage.name, error=e))
+
+    def run_stage(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is self.STOP:
+                break
+
+            try:
+                result = stage.work(item)
+            except Exception as e:
+                self.report(stage, self.on_error, item, e)
+                continue
+
+            if result is None and next_stage is not None:
+                next_stage.queue.put(item)
+            else:
+                self.report(stage, self.on_result, item, result)
+
+        # The last worker out of a stage tells every worker of the next one to stop
+        with stage.lock:
+            stage.running -= 1
+            last = stage.running == 0
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(self.STOP)
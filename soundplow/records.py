@@ -0,0 +1,35 @@
+class Track(object):
+    """ The parts of a SoundCloud track we actually use, parsed once from the API's JSON.
+        Caches keep it as a plain list (to_row) instead of the whole JSON dict.
+    """
+    __slots__ = ('id', 'title', 'username', 'stream_url', 'streamable', 'artwork_url', 'duration', 'genre', 'created_at', 'permalink_url')
+
+    def __init__(self, id, title, username, stream_url=None, streamable=True, artwork_url=None, duration=None,
+                 genre=None, created_at=None, permalink_url=None):
+        self.id = id
+        self.title = title
+        self.username = username
+        self.stream_url = stream_url
+        self.streamable = streamable
+        self.artwork_url = artwork_url
+        self.duration = duration
+        self.genre = genre
+        self.created_at = created_at
+        self.permalink_url = permalink_url
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['id'], data.get('title') or '', (data.get('user') or {}).get('username') or '',
+                   data.get('stream_url'), data.get('streamable', True), data.get('artwork_url'), data.get('duration'),
+                   data.get('genre'), data.get('created_at'), data.get('permalink_url'))
+
+    @classmethod
+    def from_cache(cls, value):
+        # Caches written before tracks had their own type still hold the full JSON
+        return cls.from_json(value) if isinstance(value, dict) else cls(*value)
+
+    def to_row(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __repr__(self):
+        return 'Track({id}, {title!r})'.format(id=self.id, title=self.title)
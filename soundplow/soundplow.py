@@ -1,24 +1,49 @@
 import os
 import re
+from enum import Enum
+from threading import Lock
+from concurrent.futures import TimeoutError as FutureTimeout
+
 import requests
 import soundcloud
 
-import mutagen
-from mutagen.id3 import ID3, APIC
-from mutagen.easyid3 import EasyID3
-
 import controller
 from log import Log
+from metrics import Metrics, timed
+from network import HttpSession, ApiClient, parse_retry_after, API_HOST, RATE_LIMITED, DEFAULT_RATE_LIMIT_WAIT
+from cache import MetadataCache
+from records import Track
+from library import Library, read_track_id
+from dedup import DedupStore, DedupMode, audio_hash
+from artwork import ArtworkCache
+from throttle import BandwidthLimiter, Priority
+from tagging import build_tag, reserve_tag, tag_size, write_tag, TAG_RESERVED_SIZE
 
 FORBIDDEN_CHARACTERS = ['/', '\\', '?', '%', '*', ':', '|', '"', '<', '>']
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_ATTEMPTS = 5
+PARTIAL_SUFFIX = '.part'
+ARTWORK_SIZE = 't500x500'
+ARTWORK_WAIT = 2.0
+
+RESOLVE_CHUNK_SIZE = 16 * 1024
+RESOLVED_TRACK_PATTERN = re.compile(r'/tracks/(\d+)')
+PAGE_TRACK_PATTERN = re.compile(rb'soundcloud://sounds:(\d+)')
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_CACHE_TTL = 10 * 60
+LIKES_PAGE_SIZE = 200
+
+DownloadResult = Enum('DownloadResult', 'DOWNLOADED SKIPPED FAILED CANCELLED')
+
 def format_title(track):
     """ We want a title format of: [artist name] - [song title].
         So if the song title does not already include the artist name or is not in the format we're looking for,
         then we format it like that ourselves.
     """
-    if track.user['username'].lower() not in track.title.lower() and re.search(".* - .*", track.title.lower()) is None:
-        song_title = '{user} - {title}'.format(user=track.user['username'], title=track.title)
+    if track.username.lower() not in track.title.lower() and re.search(".* - .*", track.title.lower()) is None:
+        song_title = '{user} - {title}'.format(user=track.username, title=track.title)
     else:
         song_title = track.title
 
@@ -29,120 +54,448 @@ def format_title(track):
 
     return song_title
 
-def add_title_to_mp3(filepath, title):
+def file_track_id(path):
+    """ The track id tagged into an MP3 we downloaded, None for files we can't read or that didn't come from us. """
+    from mutagen import MutagenError
+
     try:
-        meta = EasyID3(filepath)
-    except mutagen.id3.ID3NoHeaderError:
-        meta = mutagen.File(filepath, easy=True)
-        meta.add_tags()
+        return read_track_id(path)
+    except (MutagenError, OSError):
+        return None
+
+class DownloadJob(object):
+    """ What we know about a single download as it moves through the download steps. """
+    def __init__(self, track_id, url=None, job_id=None, priority=Priority.INTERACTIVE):
+        self.track_id = track_id
+        self.url = url
+        self.job_id = job_id    # Row in the durable job queue, if the download came from there
+        self.priority = priority
+        self.track = None
+        self.artwork = None     # Future of the cover art bytes
+        self.title = None
+        self.file_path = None
+        self.claimed = False    # Whether file_path is reserved for this download, see Soundplow.claim_path
+        self.mp3_url = None
+        self.progress = None
+        self.cancel = None
 
-    meta['title'] = title
-    meta.save()
+    @property
+    def key(self):
+        # What the download is shown and reported as
+        return self.url or self.track_id
+
+    @property
+    def partial_path(self):
+        # Named after the track rather than the title, so a resume only ever continues the same track's audio
+        return os.path.join(os.path.dirname(self.file_path), str(self.track_id) + '.mp3' + PARTIAL_SUFFIX)
 
 class Soundplow(object):
-    def __init__(self, client_id):
+    def __init__(self, client_id, api_host=API_HOST):
         self.controller = None
         self.client_id = client_id
-        self.current_user_id = None
+        self.api_host = api_host
+        self.session = HttpSession()
+        self.cache = MetadataCache()
+        self.artwork = None
+        self.dedup = None
+        self.bandwidth = BandwidthLimiter()
+        self.writing = {}       # file path -> id of the track being downloaded to it
+        self.writing_lock = Lock()
 
         self.output_path = controller.DEFAULT_OUTPUT
-        if not os.path.exists(self.output_path):
-            os.makedirs(self.output_path)
+
+        # Read lazily so they follow set_cache
+        Metrics.instance().gauge('cache_hits', lambda: self.cache.hits)
+        Metrics.instance().gauge('cache_misses', lambda: self.cache.misses)
 
     def set_controller(self, controller):
         self.controller = controller
 
+    def set_cache(self, cache):
+        self.cache.close()
+        self.cache = cache
+
+    def set_output_path(self, output_path):
+        self.output_path = output_path
+
+    def set_artwork_cache(self, artwork):
+        if self.artwork is not None:
+            self.artwork.close()
+        self.artwork = artwork
+
+    def set_dedup(self, dedup):
+        if self.dedup is not None:
+            self.dedup.close()
+        self.dedup = dedup
+
     def load(self):
-        self.api = soundcloud.Client(client_id=self.client_id)
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        if self.artwork is None:
+            self.artwork = ArtworkCache(self.fetch_artwork)
+        if self.dedup is None:
+            self.dedup = DedupStore()
 
-    def set_user(self, username):
-        self.current_user_id = self.get_user(username).id
+        self.api = ApiClient(self.session, self.client_id, self.api_host)
+        self.library = Library(self.output_path)
+
+        Log.instance().info("Library loaded with {count} tracks from {path}.".format(count=len(self.library), path=self.output_path))
 
     def get_track(self, track_id):
-        return self.api.get('/tracks/{track_id}'.format(track_id=track_id))
+        fetch = lambda: Track.from_json(self.api.get_json('/tracks/{track_id}'.format(track_id=track_id))).to_row()
+        return Track.from_cache(self.cache.get_or_fetch('track', track_id, fetch))
 
     def get_user(self, username):
         try:
-            user = self.api.get('/resolve', url='http://soundcloud.com/' + username)
+            user = self.cache.get_or_fetch('user', username.lower(), lambda: self.api.get('/resolve', url='http://soundcloud.com/' + username).obj)
         except requests.exceptions.HTTPError as e:
-            Log.instance().warning("Invalid user \"{username}\" entered! Please try again with a valid user.".format(username=username))
-            user = None
+            if e.response is not None and e.response.status_code == 404:
+                Log.instance().warning("Invalid user \"{username}\" entered! Please try again with a valid user.".format(username=username))
+            else:
+                Log.instance().warning("Could not look up user \"{username}\" ({error}). Please try again in a bit.".format(username=username, error=e))
+            return None
 
-        return user
+        return soundcloud.resource.Resource(user)
 
     def get_track_name(self, track_id):
         return format_title(self.get_track(track_id))
 
-    def download_by_url(self, track_url):
-        # Gets track id from url and passes to below function
-        try:
-            html = requests.get(track_url)
-        except requests.exceptions.MissingSchema:
+    @timed('resolve')
+    def resolve_track_id(self, track_url):
+        """ Turns a track url into its id. Asks /resolve without following its redirect, since the id is already
+            in the Location header, and only falls back to reading the track page up to the id if that fails.
+        """
+        track_id = self.cache.get('url', track_url)
+        if track_id is not None:
+            return track_id
+
+        if not track_url.startswith('http') or 'soundcloud.com' not in track_url:
             Log.instance().warning("Invalid url \"{url}\" entered. Please enter a valid soundcloud link.".format(url=track_url))
-            return
-        track_id = (re.search(r'soundcloud://sounds:(.+?)"', html.text).group(1))
+            return None
+
+        try:
+            track_id = self.resolve_with_api(track_url) or self.resolve_from_page(track_url)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            Log.instance().error("Could not resolve {url}: {error}".format(url=track_url, error=e))
+            return None
+        if track_id is None:
+            Log.instance().error("Could not find a track id at {url}!".format(url=track_url))
+            return None
 
-        Log.instance().info("Got track id {track_id} from {url}!".format(track_id=track_id, url=track_url))
+        self.cache.set('url', track_url, track_id)
+        return track_id
 
-        self.download_by_id(track_id)
+    def resolve_with_api(self, track_url):
+        response = self.api.request('/resolve', allow_redirects=False, url=track_url)
+        if response.is_redirect:
+            match = RESOLVED_TRACK_PATTERN.search(response.headers.get('Location', ''))
+            return match.group(1) if match is not None else None
+        if response.ok and response.json().get('kind') == 'track':
+            return str(response.json()['id'])
+        return None
 
-    def download_by_id(self, track_id):
+    def resolve_from_page(self, track_url):
+        # The id sits in the page's head, so stop reading as soon as it shows up
+        with self.session.get(track_url, stream=True) as html:
+            tail = b''
+            for chunk in html.iter_content(chunk_size=RESOLVE_CHUNK_SIZE):
+                tail += chunk
+                match = PAGE_TRACK_PATTERN.search(tail)
+                if match is not None:
+                    return match.group(1).decode()
+                tail = tail[-RESOLVE_CHUNK_SIZE:]
+        return None
+
+    def download_by_id(self, track_id, progress=None, cancel=None, priority=Priority.INTERACTIVE):
+        """ progress is called with (bytes received, total bytes) as the MP3 streams in, total is 0 when unknown.
+            cancel is a threading.Event, setting it stops the transfer and keeps the partial file for later.
+            priority decides who gets bandwidth first when transfers are capped.
+        """
+        job = DownloadJob(track_id, priority=priority)
+        try:
+            result = self.check_library(job) or self.prepare_download(job) or self.transfer_download(job, progress, cancel)
+            return result or self.finish_download(job)
+        finally:
+            self.release_path(job)
+
+    # The steps of a download, each returns None to carry on or the DownloadResult the download ended with.
+    # download_by_id runs them back to back, batches run them as separate pipeline stages.
+    # Either way release_path has to be called once the download is over, however it ended.
+
+    def check_library(self, job):
+        # Skip tracks we already have before spending any requests on them
+        if self.library.contains(job.track_id):
+            Log.instance().warning("Track {track_id} already downloaded to {path}! Skipping.".format(track_id=job.track_id, path=self.library.get(job.track_id)[0]))
+            return DownloadResult.SKIPPED
+
+    @timed('metadata')
+    def prepare_download(self, job):
         # Get track data
-        track = self.get_track(track_id)
+        job.track = self.get_track(job.track_id)
 
         # Proper formatted title according to the track data (username, song title, etc)
-        formatted_song_title = format_title(track)
+        job.title = format_title(job.track)
 
         if not os.path.isdir(self.output_path):
-            Log.instance().error("Output path {path} does not exist! Aborting.".format(path=file_path))
-            return
+            Log.instance().error("Output path {path} does not exist! Aborting.".format(path=self.output_path))
+            return DownloadResult.FAILED
 
-        # Build file path and and make sure the file does not already exist
-        file_path = self.output_path + '\\' + formatted_song_title + '.mp3'
-        if os.path.isfile(file_path):
-            Log.instance().warning("File already exists at {path}! Aborting.".format(path=file_path))
-            return
+        # Build file path and and make sure the file does not already exist.
+        # A different track with the same title (e.g. a re-upload) gets its track id added to the name
+        job.file_path = os.path.join(self.output_path, job.title + '.mp3')
+        alternate_path = os.path.join(self.output_path, '{title} ({track_id}).mp3'.format(title=job.title, track_id=job.track_id))
+        if os.path.isfile(job.file_path) and file_track_id(job.file_path) != str(job.track_id):
+            job.file_path = alternate_path
+        if os.path.isfile(job.file_path):
+            if file_track_id(job.file_path) != str(job.track_id):
+                Log.instance().warning("File already exists at {path} and holds another track! Skipping.".format(path=job.file_path))
+                return DownloadResult.SKIPPED
+            Log.instance().warning("File already exists at {path}! Aborting.".format(path=job.file_path))
+            self.library.add(job.track_id, job.file_path)
+            return DownloadResult.SKIPPED
+
+        # Downloads run concurrently, make sure nothing else is writing to the same file
+        writer = self.claim_path(job)
+        if writer is not None:
+            if writer == str(job.track_id):
+                Log.instance().warning("Track {track_id} is already being downloaded! Skipping.".format(track_id=job.track_id))
+                return DownloadResult.SKIPPED
+
+            job.file_path = alternate_path
+            if os.path.isfile(job.file_path) or self.claim_path(job) is not None:
+                Log.instance().warning("Another track is already being saved as \"{title}\"! Skipping.".format(title=job.title))
+                return DownloadResult.SKIPPED
 
         # Request to get where they host the stream of the song
-        stream_url = " https://api.soundcloud.com/i1/tracks/{0}/streams?client_id={1}".format(track_id, self.client_id)
-        final_page = requests.get(stream_url)
+        final_page = self.api.request('/i1/tracks/{0}/streams'.format(job.track_id))
 
         # Make the request to get the actual MP3 file of the song
         try:
-            mp3_url = final_page.json()['http_mp3_128_url']
+            job.mp3_url = final_page.json()['http_mp3_128_url']
         except KeyError:
-            Log.instance.error("KeyError with json: {}".format(final_page.json()))
-            return
-        mp3_request = requests.get(mp3_url)
+            Log.instance().error("KeyError with json: {}".format(final_page.json()))
+            return DownloadResult.FAILED
+
+        # Fetched (or read from the artwork cache) while the audio downloads, only waited on when tagging
+        if job.track.artwork_url:
+            job.artwork = self.artwork.prefetch(job.track.artwork_url.replace('-large', '-' + ARTWORK_SIZE))
+
+    def claim_path(self, job):
+        """ Reserves job.file_path for this download. Returns None, or the id of the track already being written there. """
+        with self.writing_lock:
+            if job.file_path in self.writing:
+                return self.writing[job.file_path]
+            self.writing[job.file_path] = str(job.track_id)
+            job.claimed = True
+        return None
+
+    def release_path(self, job):
+        if job.claimed:
+            with self.writing_lock:
+                self.writing.pop(job.file_path, None)
+            job.claimed = False
+
+    @timed('artwork')
+    def fetch_artwork(self, artwork_url):
+        try:
+            response = self.session.get(artwork_url)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            Log.instance().warning("Could not get artwork from {url}: {error}".format(url=artwork_url, error=e))
+            return None
+        return response.content
+
+    @timed('transfer')
+    def transfer_download(self, job, progress=None, cancel=None):
+        # Stream the MP3 next to its final location, only moving it into place once it is complete.
+        # The file starts with space reserved for the ID3 tag so tagging doesn't have to rewrite the audio,
+        # a partial file without that space (or with a different amount) can't be resumed.
+        if not os.path.isfile(job.partial_path) or tag_size(job.partial_path) != TAG_RESERVED_SIZE:
+            reserve_tag(job.partial_path, job.track_id)
 
-        # Create MP3 file and add title metadata
-        open(file_path, 'wb').write(mp3_request.content)
-        add_title_to_mp3(file_path, formatted_song_title)
+        if not self.stream_to_file(job.mp3_url, job.partial_path, progress=progress, cancel=cancel, header_size=TAG_RESERVED_SIZE, priority=job.priority):
+            if cancel is not None and cancel.is_set():
+                Log.instance().warning("Download of \"{title}\" cancelled.".format(title=job.title))
+                return DownloadResult.CANCELLED
+            Log.instance().error("Download of \"{title}\" failed, partial file kept for resuming.".format(title=job.title))
+            return DownloadResult.FAILED
+
+    @timed('tag')
+    def finish_download(self, job):
+        # Fill in the full tag before the file becomes visible under its real name
+        artwork = self.wait_for_artwork(job)
+        write_tag(job.partial_path, build_tag(job.track, job.title, job.track_id, artwork))
+        os.replace(job.partial_path, job.file_path)
+        file_path, file_hash = self.deduplicate(job)
+        self.library.add(job.track_id, file_path, file_hash)
+
+        Log.instance().success("Downloaded track: \"{title}\"".format(title=job.title))
+
+        return DownloadResult.DOWNLOADED
+
+    @timed('dedup')
+    def deduplicate(self, job):
+        """ Checks the new file's audio against everything downloaded before. A duplicate is replaced by a hardlink
+            to the copy we already have, or deleted, depending on the dedup mode.
+            Returns where the track now lives and its audio hash (None with dedup off), which the library keeps.
+        """
+        if self.dedup.mode == DedupMode.OFF:
+            return job.file_path, None
+
+        file_hash = audio_hash(job.file_path)
+        existing = self.dedup.claim(file_hash, os.path.abspath(job.file_path))
+        if existing is None:
+            return job.file_path, file_hash
+
+        size = os.path.getsize(job.file_path)
+        if self.dedup.mode == DedupMode.SKIP:
+            os.remove(job.file_path)
+            Log.instance().warning("\"{title}\" has the same audio as {path}, not keeping another copy.".format(title=job.title, path=existing))
+            Metrics.instance().increment('duplicates_total', action='skip')
+            Metrics.instance().increment('dedup_saved_bytes_total', size)
+            return existing, file_hash
+
+        # Linked next to the file first, so it is only ever swapped for a complete link
+        link_path = job.file_path + PARTIAL_SUFFIX
+        try:
+            os.link(existing, link_path)
+            os.replace(link_path, job.file_path)
+        except OSError as e:
+            # Other drive, or a file system without hardlinks
+            Log.instance().warning("Could not link \"{title}\" to {path}, keeping a copy: {error}".format(title=job.title, path=existing, error=e))
+            if os.path.isfile(link_path):
+                os.remove(link_path)
+            return job.file_path, file_hash
 
-        Log.instance().success("Downloaded track: \"{title}\"".format(title=formatted_song_title))
+        Log.instance().info("\"{title}\" has the same audio as {path}, linked to it.".format(title=job.title, path=existing))
+        Metrics.instance().increment('duplicates_total', action='link')
+        Metrics.instance().increment('dedup_saved_bytes_total', size)
+        return job.file_path, file_hash
 
-    def search_for_songs(self, query):
+    def wait_for_artwork(self, job):
+        # Tagging runs one file at a time, a slow artwork host mustn't hold up everything behind this one
+        if job.artwork is None:
+            return None
+        try:
+            return job.artwork.result(timeout=ARTWORK_WAIT)
+        except FutureTimeout:
+            Log.instance().warning("Artwork for \"{title}\" is taking too long, tagging without it.".format(title=job.title))
+            Metrics.instance().increment('artwork_timeouts_total')
+            return None
+
+    def stream_to_file(self, url, file_path, attempts=DOWNLOAD_ATTEMPTS, progress=None, cancel=None, header_size=0, priority=Priority.INTERACTIVE):
+        """ Streams url into file_path in fixed size chunks so memory use stays constant.
+            Whatever is already in file_path is kept and the rest is requested with a Range header,
+            so dropped connections (or a previous run) only cost the missing bytes.
+            The first header_size bytes of file_path aren't part of the download and are left alone.
+            Chunks are read no faster than self.bandwidth allows.
+        """
+        if not os.path.isfile(file_path):
+            open(file_path, 'wb').close()
+        transfer = self.bandwidth.transfer(priority)
+
+        for attempt in range(1, attempts + 1):
+            offset = max(0, os.path.getsize(file_path) - header_size)
+            headers = {'Range': 'bytes={offset}-'.format(offset=offset)} if offset > 0 else {}
+
+            try:
+                with self.session.get(url, headers=headers, stream=True) as response:
+                    if response.status_code == 416:
+                        # Our partial file does not match the remote one anymore, start over
+                        with open(file_path, 'r+b') as mp3_file:
+                            mp3_file.truncate(header_size)
+                        continue
+                    response.raise_for_status()
+
+                    # Servers that ignore Range send the whole body back, so we can't append to what we have
+                    if response.status_code != 206:
+                        offset = 0
+                    received = offset
+                    total = offset + int(response.headers['Content-Length']) if 'Content-Length' in response.headers else 0
+
+                    with open(file_path, 'r+b') as mp3_file:
+                        mp3_file.seek(header_size + offset)
+                        mp3_file.truncate()
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if cancel is not None and cancel.is_set():
+                                return False
+                            mp3_file.write(chunk)
+                            received += len(chunk)
+                            Metrics.instance().increment('downloaded_bytes_total', len(chunk))
+                            if not transfer.consume(len(chunk), cancel):
+                                return False
+                            if progress is not None:
+                                progress(received, total)
+                return True
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                Log.instance().warning("Connection dropped while downloading ({attempt}/{attempts}): {error}".format(attempt=attempt, attempts=attempts, error=e))
+                Metrics.instance().increment('retries_total', kind='transfer')
+            except requests.exceptions.HTTPError as e:
+                Log.instance().error("Download request failed: {error}".format(error=e))
+                return False
+
+        return False
+
+    def search_for_songs(self, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        """ Yields one page of search results. Only the page asked for is requested from the API,
+            and pages are cached by query for a short while so repeated searches don't hit the API again.
+        """
         if query is None or query == "":
             Log.instance().warning("Please enter a non-empty search query.")
             return
 
-        tracks = self.api.get('/tracks', q=query)
-        if isinstance(tracks, soundcloud.resource.ResourceList):
-            for i in range(len(tracks.data)):
-                yield tracks.data[i]
-        else:
-            yield tracks
+        @timed('search')
+        def fetch():
+            tracks = self.api.get_json('/tracks', q=query, limit=limit, offset=offset)
+            if isinstance(tracks, dict):
+                tracks = tracks.get('collection', [tracks])
+            return [Track.from_json(track).to_row() for track in tracks]
+
+        page_key = '{limit}:{offset}:{query}'.format(limit=limit, offset=offset, query=query.strip().lower())
+        for track in self.cache.get_or_fetch('search', page_key, fetch, ttl=SEARCH_CACHE_TTL)[:limit]:
+            yield Track.from_cache(track)
+
+    def iter_like_pages(self, user_id, cursor=None, page_size=LIKES_PAGE_SIZE):
+        """ Walks a user's whole like history, newest first, one page at a time. Yields (track ids, cursor of the
+            next page), the cursor being None after the last page. Passing a yielded cursor back in carries on
+            from there, and only one page is ever held in memory.
+        """
+        # next_href already carries the paging parameters
+        resource, params = (cursor, {}) if cursor else ('/users/{id}/favorites'.format(id=user_id), {'linked_partitioning': 1, 'limit': page_size})
+        while resource is not None:
+            with Metrics.instance().timer('stage_seconds', stage='likes_page'):
+                response = self.api.request(resource, **params)
+                response.raise_for_status()
+                page = response.json()
+
+            resource, params = page.get('next_href'), {}
+            yield [track['id'] for track in page.get('collection', []) if track.get('kind', 'track') == 'track'], resource
+
+    @timed('likes')
+    def get_likes(self, user_id, limit=None, etag=None):
+        """ Returns (ids of the user's latest likes, ETag, seconds to wait before asking again).
+            The ids are None if they could not be fetched or haven't changed since the response etag came from,
+            which then only costs a bodiless 304. The wait is None unless the API asked for one.
+        """
+        headers = {'If-None-Match': etag} if etag is not None else None
+        response = self.api.request('/users/{id}/favorites'.format(id=user_id), headers=headers, limit=limit)
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if response.status_code == 304:
+            return None, etag, retry_after
+        if response.status_code == RATE_LIMITED:
+            # Still limited after the session's own retries, back the like checks off too
+            retry_after = retry_after or DEFAULT_RATE_LIMIT_WAIT
+            Log.instance().warning("Soundcloud is rate limiting like checks, waiting {seconds:.0f}s.".format(seconds=retry_after))
+            return None, etag, retry_after
 
-    def get_last_liked(self):
-        if self.current_user_id is None:
-            Log.instance().error("No user was entered! Please enter a username.")
-            return
         try:
-            liked_tracks = self.api.get('/users/{id}/favorites'.format(id=self.current_user_id))
+            response.raise_for_status()
         except requests.exceptions.HTTPError:
             Log.instance().warning("Unexpected Soundcloud API error. Will try again.")
-            return
-        if len(liked_tracks) > 0:
-            return [track.id for track in liked_tracks]
-        else:
-            return []
+            return None, etag, retry_after
+
+        # Only the ids are kept, no need to build anything out of the rest
+        liked_tracks = response.json()
+        if isinstance(liked_tracks, dict):
+            liked_tracks = liked_tracks.get('collection', [])
+        return [track['id'] for track in liked_tracks if track.get('kind', 'track') == 'track'], response.headers.get('ETag'), retry_after
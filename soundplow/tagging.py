@@ -0,0 +1,75 @@
+import struct
+
+TRACK_ID_TAG = 'soundcloud_id'
+TAG_RESERVED_SIZE = 128 * 1024
+ID3_HEADER_SIZE = 10
+
+# mutagen is imported inside the functions, the headless entry point shouldn't pay for it unless it writes tags
+
+def build_tag(track, title, track_id, artwork=None):
+    """ Builds the full ID3v2 tag of a track in memory: title, artist, genre, date, SoundCloud id/url and cover art. """
+    from mutagen.id3 import ID3, TIT2, TPE1, TCON, TDRC, TXXX, WOAF, APIC
+
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=title))
+    tags.add(TPE1(encoding=3, text=track.username))
+    tags.add(TXXX(encoding=3, desc=TRACK_ID_TAG, text=str(track_id)))
+
+    if track.genre:
+        tags.add(TCON(encoding=3, text=track.genre))
+    if track.created_at:
+        # "2017/05/01 12:00:00 +0000" -> "2017-05-01"
+        tags.add(TDRC(encoding=3, text=track.created_at[:10].replace('/', '-')))
+    if track.permalink_url:
+        tags.add(WOAF(url=track.permalink_url))
+    if artwork is not None:
+        tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=artwork))
+
+    return tags
+
+def render_tag(tags, size):
+    """ Returns the tag as exactly size bytes (the rest being ID3 padding), or None if it doesn't fit. """
+    import io
+
+    data = io.BytesIO()
+    tags.save(data, padding=lambda info: 0)
+    minimum = len(data.getvalue())
+    if minimum > size:
+        return None
+
+    data = io.BytesIO()
+    tags.save(data, padding=lambda info: size - minimum)
+    return data.getvalue()
+
+def tag_size(path):
+    """ Size of the ID3v2 tag at the start of path, 0 if there is none. """
+    with open(path, 'rb') as f:
+        header = f.read(ID3_HEADER_SIZE)
+    if len(header) < ID3_HEADER_SIZE or header[:3] != b'ID3':
+        return 0
+
+    # Tag sizes are stored as four 7-bit "syncsafe" bytes
+    size = 0
+    for byte in struct.unpack('4B', header[6:10]):
+        size = (size << 7) | (byte & 0x7f)
+    return ID3_HEADER_SIZE + size
+
+def reserve_tag(path, track_id, size=TAG_RESERVED_SIZE):
+    """ Starts a new file with a placeholder tag of size bytes, the audio then gets written after it
+        and write_tag fills the real tag into the same space, so the audio is only ever written once.
+    """
+    from mutagen.id3 import ID3, TXXX
+
+    tags = ID3()
+    tags.add(TXXX(encoding=3, desc=TRACK_ID_TAG, text=str(track_id)))
+    with open(path, 'wb') as f:
+        f.write(render_tag(tags, size))
+
+def write_tag(path, tags, size=TAG_RESERVED_SIZE):
+    data = render_tag(tags, size)
+    if data is not None and tag_size(path) == size:
+        with open(path, 'r+b') as f:
+            f.write(data)
+    else:
+        # Too big for the reserved space (huge artwork), let mutagen rewrite the file
+        tags.save(path)
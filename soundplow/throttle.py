@@ -0,0 +1,99 @@
+import time
+import heapq
+import itertools
+from enum import IntEnum
+from threading import Condition
+
+from metrics import Metrics
+
+BURST_SECONDS = 0.25
+MAX_WAIT = 0.1
+
+class Priority(IntEnum):
+    """ Lower goes first. Live likes and search clicks are interactive, link batches are bulk work. """
+    INTERACTIVE = 0
+    BATCH = 1
+
+class TokenBucket(object):
+    """ Hands out rate bytes per second, allowing bursts of up to BURST_SECONDS worth. A rate of 0 means unlimited.
+        Callers waiting for tokens are served by priority, then in arrival order, so interactive transfers
+        get what they need first and batches share whatever is left.
+    """
+    def __init__(self, rate=0):
+        self.condition = Condition()
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.tokens = 0.0
+        self.configure(rate)
+
+    def configure(self, rate):
+        with self.condition:
+            self.rate = rate
+            self.capacity = rate * BURST_SECONDS
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+            self.condition.notify_all()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount, priority=Priority.INTERACTIVE, cancel=None):
+        """ Blocks until amount bytes may be sent. Returns False if cancel got set while waiting. """
+        if self.rate <= 0:
+            return True
+
+        ticket = (priority, next(self.tickets))
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        return False
+                    if self.rate <= 0:
+                        return True
+
+                    self.refill()
+                    # Chunks bigger than the bucket are let through on a full bucket and paid back by going negative
+                    needed = min(amount, self.capacity)
+                    if self.waiting[0] == ticket and self.tokens >= needed:
+                        self.tokens -= amount
+                        return True
+
+                    wait = (needed - self.tokens) / self.rate if self.waiting[0] == ticket else MAX_WAIT
+                    self.condition.wait(min(max(wait, 0.001), MAX_WAIT))
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+class BandwidthLimiter(object):
+    """ Caps MP3 transfers at rate bytes per second in total and per_download_rate bytes per second each
+        (0 for no cap). Every transfer gets its own Transfer from transfer() and reports each chunk to it.
+    """
+    def __init__(self, rate=0, per_download_rate=0):
+        self.bucket = TokenBucket()
+        self.configure(rate, per_download_rate)
+
+    def configure(self, rate=0, per_download_rate=0):
+        self.bucket.configure(rate)
+        self.per_download_rate = per_download_rate
+
+    def transfer(self, priority=Priority.INTERACTIVE):
+        return Transfer(self, priority)
+
+class Transfer(object):
+    def __init__(self, limiter, priority):
+        self.limiter = limiter
+        self.priority = priority
+        self.bucket = TokenBucket(limiter.per_download_rate)
+
+    def consume(self, amount, cancel=None):
+        start = time.monotonic()
+        allowed = self.bucket.consume(amount, cancel=cancel) and self.limiter.bucket.consume(amount, self.priority, cancel)
+
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            Metrics.instance().increment('throttled_seconds_total', waited, priority=self.priority.name.lower())
+        return allowed
@@ -1,20 +1,24 @@
 import sys
 from functools import partial
+from threading import Event, Lock
 
 from PySide2.QtUiTools import QUiLoader
-from PySide2.QtWidgets import QApplication, QWidget, QLineEdit, QTextEdit, QPushButton, QListWidget, QTabWidget, QLabel, QVBoxLayout, QShortcut
-from PySide2.QtCore import QFile, QObject, Signal, Qt
+from PySide2.QtWidgets import QApplication, QWidget, QLineEdit, QTextEdit, QPushButton, QListView, QAbstractItemView, QTabWidget, QLabel, QVBoxLayout, QHBoxLayout, QProgressBar, QShortcut, QFileDialog
+from PySide2.QtCore import QFile, QObject, QRunnable, QThreadPool, QTimer, Signal, Qt, QAbstractListModel, QModelIndex
 from PySide2.QtGui import QKeySequence
 
-from controller import Controller, DEFAULT_OUTPUT
+from controller import Controller, DEFAULT_OUTPUT, DEFAULT_SEARCH_RESULTS, CLIENT_ID
 from soundplow import Soundplow
 from log import Log, MessageType
+from metrics import Metrics
+from links import parse_links
 from exceptions import WidgetNotFound
 
 MAIN_UI = 'resources/ui.ui'
 SEARCH_RESULTS_POPUP_UI = 'resources/search_results.ui'
-CLIENT_ID = 'resources/secret.txt'
 STYLE_SHEET = 'resources/stylesheet.qss'
+METRICS_REFRESH_MS = 1000
+DOWNLOAD_TASK_THREADS = 16
 
 class UIObject(QObject):
     def __init__(self, parent=None):
@@ -29,6 +33,8 @@ class UIObject(QObject):
         return widget
 
 class Button(UIObject):
+    text_toggled = Signal()
+
     def __init__(self, button):
         UIObject.__init__(self)
 
@@ -38,6 +44,8 @@ class Button(UIObject):
         self.enabled_text = self.parent.text()
         self.disabled_text = self.parent.text()
 
+        self.text_toggled.connect(self.apply_toggle)
+
     def when_clicked(self, event):
         self.parent.clicked.connect(event)
 
@@ -45,6 +53,10 @@ class Button(UIObject):
         self.parent.setText(text)
 
     def toggle_text(self):
+        # Safe to call from any thread, the text itself is only changed on the GUI thread
+        self.text_toggled.emit()
+
+    def apply_toggle(self):
         self.enabled = not self.enabled
         if self.enabled:
             self.set_text(self.enabled_text)
@@ -88,42 +100,246 @@ class Tab(UIObject):
         del self.popup
         self.popup = None
 
+class LinkListModel(QAbstractListModel):
+    """ The links in the link tab, kept as a plain list plus a set of the same links for duplicate checks. """
+    def __init__(self):
+        QAbstractListModel.__init__(self)
+
+        self.links = []
+        self.known = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.links)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.links[index.row()]
+        return None
+
+    def add_links(self, links):
+        """ Appends the links that aren't in the list yet, in one insert. Returns the ones that were added. """
+        new_links = []
+        for link in links:
+            if link not in self.known:
+                self.known.add(link)
+                new_links.append(link)
+
+        if len(new_links) > 0:
+            self.beginInsertRows(QModelIndex(), len(self.links), len(self.links) + len(new_links) - 1)
+            self.links.extend(new_links)
+            self.endInsertRows()
+        return new_links
+
+    def set_links(self, links):
+        self.beginResetModel()
+        self.links = list(links)
+        self.known = set(self.links)
+        self.endResetModel()
+
+    def remove_rows(self, rows):
+        """ Removes the given rows, returns their links. """
+        removed = []
+        for row in sorted(set(rows), reverse=True):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            link = self.links.pop(row)
+            self.known.discard(link)
+            self.endRemoveRows()
+            removed.append(link)
+        removed.reverse()
+        return removed
+
 class ListView(UIObject):
+    items_removed = Signal(list)
+
     def __init__(self, listview):
         UIObject.__init__(self)
 
         self.parent = listview
+        self.model = LinkListModel()
+        self.parent.setModel(self.model)
+        # Rows are all the same height, so only the visible ones ever get laid out
+        self.parent.setUniformItemSizes(True)
+        self.parent.setLayoutMode(QListView.Batched)
+        self.parent.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
         delete_shortcut = QShortcut(QKeySequence(Qt.Key_Delete), self.parent)
         delete_shortcut.activated.connect(self.delete_current)
 
-    def add_item(self, text):
-        if not isinstance(text, str):
-            raise RuntimeError("Only strings accepted in ListView object!")
-
-        if text is '':
+    def add_text(self, text):
+        """ Adds every track link found in text (typed, pasted or read from a file). Returns the links that were added. """
+        if text.strip() == '':
             Log.instance().warning("Please enter a link in the textbox.")
-            return
+            return []
 
-        if ',' in text:
-            Log.instance().warning("Invalid character \",\" found in link \"{}\". Please check your link.".format(text))
-            return
-
-        if r'soundcloud.com' not in text:
-            Log.instance().warning("Invalid link \"{}\" entered. Link with: \"...soundcloud.com/...\" expected.".format(text))
-            return
+        links, invalid = parse_links(text)
+        added = self.model.add_links(links)
+        duplicates = len(links) - len(added)
 
-        self.parent.addItem(text)
+        if len(links) == 1 and invalid == 0:
+            if duplicates > 0:
+                Log.instance().warning("Link \"{}\" is already in the list.".format(links[0]))
+        elif len(links) == 0 and invalid == 1:
+            Log.instance().warning("Invalid link \"{}\" entered. Link with: \"...soundcloud.com/<user>/<track>\" expected.".format(text.strip()))
+        else:
+            Log.instance().info("Added {added} links, skipped {duplicates} duplicates and {invalid} entries that aren't track links.".format(
+                added=len(added), duplicates=duplicates, invalid=invalid))
+        return added
 
     def get_items(self):
-        num_items = self.parent.count()
-        for i in range(num_items):
-            yield str(self.parent.takeItem(0).text())
+        return list(self.model.links)
+
+    def set_items(self, items):
+        self.model.set_links(items)
 
     def delete_current(self):
-        if len(self.parent.selectedItems()) > 0:
-            self.parent.takeItem(self.parent.currentRow())
+        rows = [index.row() for index in self.parent.selectionModel().selectedRows()]
+        if len(rows) > 0:
+            self.items_removed.emit(self.model.remove_rows(rows))
+
+
+class TaskSignals(QObject):
+    finished = Signal(object, object)
+    failed = Signal(object, str)
+
+class Task(QRunnable):
+    """ Runs fn(*args, **kwargs) on the Qt thread pool and hands the result back through signals.
+        Only connect the signals to methods of QObjects living on the GUI thread, so they get queued there.
+    """
+    def __init__(self, fn, *args, **kwargs):
+        QRunnable.__init__(self)
+
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self.cancelled = Event()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(self, str(e))
+        else:
+            self.signals.finished.emit(self, result)
+
+    def cancel(self):
+        self.cancelled.set()
 
+class DownloadsPanel(UIObject):
+    """ One row with a progress bar and a cancel button per running download.
+        Acts as the download listener for the controller, so its track_* methods get called from worker
+        threads and only ever talk to the widgets through queued signals.
+    """
+    row_added = Signal(object)
+    row_progress = Signal(object, int)
+    row_removed = Signal(object)
+
+    def __init__(self):
+        UIObject.__init__(self)
+
+        self.parent = QWidget()
+        self.layout = QVBoxLayout(self.parent)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+
+        self.cancel_all_button = QPushButton(text="Cancel All Downloads")
+        self.cancel_all_button.clicked.connect(self.cancel_all)
+        self.cancel_all_button.hide()
+        self.layout.addWidget(self.cancel_all_button)
+
+        self.rows = {}
+        self.cancel_events = {}
+        self.percentages = {}
+        self.lock = Lock()
+
+        self.row_added.connect(self.add_row)
+        self.row_progress.connect(self.set_row_progress)
+        self.row_removed.connect(self.remove_row)
+
+    def track_started(self, key):
+        with self.lock:
+            cancel = self.cancel_events[key] = Event()
+            self.percentages[key] = -1
+        self.row_added.emit(key)
+        return cancel
+
+    def track_progress(self, key, received, total):
+        # Only bother the GUI thread when the bar would actually move
+        percentage = int(received * 100 / total) if total > 0 else 0
+        with self.lock:
+            if self.percentages.get(key) == percentage:
+                return
+            self.percentages[key] = percentage
+        self.row_progress.emit(key, percentage)
+
+    def track_finished(self, key, result):
+        with self.lock:
+            self.cancel_events.pop(key, None)
+            self.percentages.pop(key, None)
+        self.row_removed.emit(key)
+
+    def cancel(self, key):
+        with self.lock:
+            cancel = self.cancel_events.get(key)
+        if cancel is not None:
+            cancel.set()
+
+    def cancel_all(self):
+        with self.lock:
+            for cancel in self.cancel_events.values():
+                cancel.set()
+
+    def add_row(self, key):
+        row = QWidget()
+        row_layout = QHBoxLayout(row)
+        row_layout.setContentsMargins(0, 0, 0, 0)
+
+        label = QLabel(text=str(key))
+        label.setMinimumWidth(200)
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, 100)
+        cancel_button = QPushButton(text="Cancel")
+        cancel_button.clicked.connect(partial(self.cancel, key))
+        cancel_button.clicked.connect(partial(cancel_button.setEnabled, False))
+
+        row_layout.addWidget(label, 1)
+        row_layout.addWidget(progress_bar, 2)
+        row_layout.addWidget(cancel_button)
+
+        self.rows[key] = (row, progress_bar)
+        self.layout.addWidget(row)
+        self.cancel_all_button.show()
+
+    def set_row_progress(self, key, percentage):
+        if key in self.rows:
+            self.rows[key][1].setValue(percentage)
+
+    def remove_row(self, key):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            row[0].deleteLater()
+        if len(self.rows) == 0:
+            self.cancel_all_button.hide()
+
+class MetricsPanel(UIObject):
+    """ A label summarizing stage timings, throughput and cache use, plus how backed up a running batch is.
+        Redrawn from a timer on the GUI thread, Metrics itself can be read from any thread.
+    """
+    def __init__(self):
+        UIObject.__init__(self, QLabel())
+
+        self.depths = None
+        self.parent.setTextInteractionFlags(Qt.TextSelectableByMouse)
+
+        self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(METRICS_REFRESH_MS)
+
+    def refresh(self):
+        lines = Metrics.instance().summary()
+        depths = self.depths() if self.depths is not None else []
+        if len(depths) > 0:
+            lines.append("queued: " + ", ".join("{name} {depth}".format(name=name, depth=depth) for name, depth in depths))
+        self.parent.setText("\n".join(lines))
 
 class UI(UIObject):
     tab_names = ["search", "like", "link"]
@@ -147,12 +363,32 @@ class UI(UIObject):
             self.tabs[name] = Tab(name, self.get_widget(QWidget, "tab_{suffix}".format(suffix=name)))
 
         if 'link' in self.tabs:
-            self.track_list = ListView(self.get_widget(QListWidget, "track_list"))
+            self.track_list = ListView(self.get_widget(QListView, "track_list"))
             self.download_all_button = Button(self.get_widget(QPushButton, "button_download_all"))
+            self.import_button = Button(self.get_widget(QPushButton, "button_import"))
+            self.paste_button = Button(self.get_widget(QPushButton, "button_paste"))
+
+        if 'like' in self.tabs:
+            self.backfill_button = Button(self.get_widget(QPushButton, "button_backfill"))
 
         self.output_textbox = Textbox(self.get_widget(QLineEdit, "textbox_output"))
 
-        Log.instance().load(self.get_widget(QTextEdit, "log"))
+        # Network and disk work runs on these pools, the GUI thread only ever updates widgets.
+        # Downloads (batches and backfills can take hours) get their own pool so searches never queue up behind them
+        self.thread_pool = QThreadPool.globalInstance()
+        self.download_pool = QThreadPool()
+        self.download_pool.setMaxThreadCount(DOWNLOAD_TASK_THREADS)
+        self.tasks = set()
+
+        log_widget = self.get_widget(QTextEdit, "log")
+        self.downloads = DownloadsPanel()
+        main_layout = self.get_widget(QVBoxLayout, "verticalLayout_4")
+        main_layout.insertWidget(main_layout.indexOf(log_widget), self.downloads.parent)
+        self.downloads.cancel_all_button.clicked.connect(self.cancel_all_tasks)
+        self.metrics = MetricsPanel()
+        main_layout.insertWidget(main_layout.indexOf(log_widget), self.metrics.parent)
+
+        Log.instance().load(log_widget)
 
         self.parent.show()
 
@@ -172,21 +408,143 @@ class UI(UIObject):
 
     def set_controller(self, controller):
         self.controller = controller
+        self.metrics.depths = controller.pipeline_depths
+
+    def run_task(self, fn, *args, **kwargs):
+        return self.start_task(self.thread_pool, Task(fn, *args, **kwargs))
+
+    def run_download_task(self, fn, *args, **kwargs):
+        return self.start_task(self.download_pool, Task(fn, *args, **kwargs))
+
+    def start_task(self, pool, task):
+        self.tasks.add(task)
+        task.signals.finished.connect(self.task_done)
+        task.signals.failed.connect(self.task_failed)
+        pool.start(task)
+        return task
+
+    def task_done(self, task, result):
+        self.tasks.discard(task)
+
+    def task_failed(self, task, error):
+        self.tasks.discard(task)
+        Log.instance().error("Background task failed: {error}".format(error=error))
+
+    def add_links(self, text):
+        # Links are saved in the job queue straight away (off the GUI thread, big pastes take a moment)
+        links = self.track_list.add_text(text)
+        if len(links) > 0:
+            self.run_task(self.controller.queue_urls, links)
+
+    def import_links(self):
+        path, _ = QFileDialog.getOpenFileName(self.parent, "Import Links", "", "Text files (*.txt *.csv);;All files (*)")
+        if path:
+            with open(path, 'r', errors='replace') as link_file:
+                self.add_links(link_file.read())
+
+    def paste_links(self):
+        self.add_links(QApplication.clipboard().text())
+
+    def download_all(self):
+        # The list shows the job queue, which the batch works through from the pool.
+        # Only one batch at a time, two would work through the same queue
+        self.download_all_button.parent.setEnabled(False)
+        cancel = Event()
+        task = self.run_download_task(self.controller.download_queued, listener=self.downloads, cancel=cancel)
+        task.cancelled = cancel
+        task.signals.finished.connect(self.download_all_done)
+        task.signals.failed.connect(self.download_all_done)
+
+    def download_all_done(self, task, result):
+        self.download_all_button.parent.setEnabled(True)
+        self.track_list.set_items(self.controller.queued_urls())
+
+    def backfill_likes(self):
+        self.backfill_button.parent.setEnabled(False)
+        cancel = Event()
+        task = self.run_download_task(self.controller.backfill_likes, self.tabs['like'].textbox.get_text(), listener=self.downloads, cancel=cancel)
+        task.cancelled = cancel
+        task.signals.finished.connect(self.backfill_done)
+        task.signals.failed.connect(self.backfill_done)
+
+    def backfill_done(self, task, result):
+        self.backfill_button.parent.setEnabled(True)
+
+    def download_track_by_id(self, track_id):
+        self.run_download_task(self.controller.download_track_by_id, track_id, listener=self.downloads)
+
+    def cancel_all_tasks(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def search(self, query):
+        task = self.run_task(lambda: (query, self.controller.get_search_results(query)))
+        task.signals.finished.connect(self.show_search_results)
+
+    def show_search_results(self, task, query_and_results):
+        self.search_result_popup(*query_and_results)
+
+    def load_more_search_results(self):
+        popup = self.tabs['search'].popup
+        if popup is None:
+            return
+
+        popup.load_more_button.setEnabled(False)
+        query, offset = popup.query, popup.offset
+        task = self.run_task(lambda: (query, self.controller.get_search_results(query, offset=offset)))
+        task.signals.finished.connect(self.show_more_search_results)
+
+    def show_more_search_results(self, task, query_and_results):
+        query, search_results = query_and_results
+        popup = self.tabs['search'].popup
+        # The dialog may have been closed, or reopened for another search, while the page loaded
+        if popup is None or popup.query != query:
+            return
+        self.add_search_results(search_results)
+
+    def add_search_results(self, search_results):
+        popup = self.tabs['search'].popup
+        button_area = popup.get_widget(QVBoxLayout, 'button_area')
+        for i in range(len(search_results)):
+            # Create a button out of each search_result
+            button = QPushButton(text=self.controller.get_track_name(search_results[i]))
+            button_font = button.font()
+            button_font.setPointSize(12)
+            button.setFont(button_font)
+
+            # Connect each button to downloading the song
+            # NOTE: Partial used instead of lambda because they save the current value to excude the func (lambda would use the last i value cause its incremented)
+            button.clicked.connect(partial(self.download_track_by_id, search_results[i].id))
+            button.clicked.connect(partial(button.setEnabled, False))
+
+            # Keep the "load more" button below the results
+            button_area.insertWidget(button_area.count() - 1, button)
+
+        popup.offset += len(search_results)
+        # A short page means the API has nothing more for us
+        popup.load_more_button.setEnabled(len(search_results) >= DEFAULT_SEARCH_RESULTS)
 
     def initialize_tabs(self):
         if 'link' in self.tabs:
-            self.tabs['link'].on_click.connect(lambda: self.track_list.add_item(self.tabs['link'].textbox.take_text()))
+            self.tabs['link'].on_click.connect(lambda: self.add_links(self.tabs['link'].textbox.take_text()))
+            self.track_list.items_removed.connect(lambda urls: self.controller.remove_queued_urls(urls))
+            self.import_button.when_clicked(self.import_links)
+            self.paste_button.when_clicked(self.paste_links)
+
+            paste_shortcut = QShortcut(QKeySequence.Paste, self.track_list.parent)
+            paste_shortcut.activated.connect(self.paste_links)
 
-            self.download_all_button.when_clicked(lambda : self.controller.batch_download_urls(self.track_list.get_items()))
+            self.download_all_button.when_clicked(self.download_all)
 
         if 'search' in self.tabs:
-            self.tabs['search'].on_click.connect(lambda: self.search_result_popup(self.tabs['search'].textbox.get_text(), self.controller.get_search_results(self.tabs['search'].textbox.get_text())))
+            self.tabs['search'].on_click.connect(lambda: self.search(self.tabs['search'].textbox.get_text()))
 
         if 'like' in self.tabs:
             tab = self.tabs['like']
             self.tabs['like'].button.disabled_text = "Start Listening"
             self.tabs['like'].button.enabled_text = "Stop Listening"
-            self.tabs['like'].on_click.connect(lambda: self.controller.toggle_listen_for_likes(self.tabs['like'].textbox.get_text()))
+            self.tabs['like'].on_click.connect(lambda: self.run_task(self.controller.toggle_listen_for_likes, self.tabs['like'].textbox.get_text()))
+            self.backfill_button.when_clicked(self.backfill_likes)
 
     def search_result_popup(self, query, search_results):
         if 'search' in self.tabs:
@@ -211,21 +569,15 @@ class UI(UIObject):
             title = self.tabs['search'].popup.get_widget(QLabel, 'title')
             title.setText(title.text().format(query=query)) # already set to {query} in QtDesigner
 
-            # Get button area
+            # Get button area, results are added above the "load more" button which fetches the next page on demand
             button_area = self.tabs['search'].popup.get_widget(QVBoxLayout, 'button_area')
-            for i in range(len(search_results)):
-                # Create a button out of each search_result
-                button = QPushButton(text=self.controller.get_track_name(search_results[i]))
-                button_font = button.font()
-                button_font.setPointSize(12)
-                button.setFont(button_font)
-
-                # Connect each button to downloading the song
-                # NOTE: Partial used instead of lambda because they save the current value to excude the func (lambda would use the last i value cause its incremented)
-                button.clicked.connect(partial(self.controller.download_track_by_id, search_results[i].id))
-                button.clicked.connect(partial(button.setEnabled, False))
-
-                button_area.addWidget(button)
+            self.tabs['search'].popup.query = query
+            self.tabs['search'].popup.offset = 0
+            self.tabs['search'].popup.load_more_button = QPushButton(text="Load More")
+            self.tabs['search'].popup.load_more_button.clicked.connect(self.load_more_search_results)
+            button_area.addWidget(self.tabs['search'].popup.load_more_button)
+
+            self.add_search_results(search_results)
 
             # Handle closing the dialog
             self.tabs['search'].popup.parent.destroyed.connect(self.reset_search_dialog)
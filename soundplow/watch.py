@@ -0,0 +1,161 @@
+import time
+import heapq
+import random
+import itertools
+from queue import Queue
+from threading import Thread, Condition, Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from log import Log
+
+DEFAULT_WATCH_WORKERS = 4
+DEFAULT_LIKE_DOWNLOAD_WORKERS = 2
+
+class WatchedUser(object):
+    """ Polling state of one watched account. """
+    __slots__ = ('user_id', 'username', 'etag', 'interval', 'next_poll', 'deferred')
+
+    def __init__(self, user_id, username, interval, next_poll):
+        self.user_id = user_id
+        self.username = username
+        self.etag = None
+        self.interval = interval
+        self.next_poll = next_poll
+        self.deferred = 0.0
+
+    def defer(self, seconds):
+        """ Makes the next poll wait at least this long, e.g. for a Retry-After header. """
+        if seconds is not None:
+            self.deferred = max(self.deferred, seconds)
+
+class LikeWatcher(object):
+    """ Polls the likes of any number of users from one scheduler thread and a fixed pool of workers.
+        check(user) polls one WatchedUser and returns how many new likes it found, any at all resets that user's
+        delay to min_interval; every quiet poll multiplies it by backoff, up to max_interval. Delays get
+        +/- jitter and new users start at a random point of their first interval, so polls stay spread out.
+        New likes go through enqueue() into one download queue, drained by download_workers threads.
+    """
+    def __init__(self, check, download, workers=DEFAULT_WATCH_WORKERS, download_workers=DEFAULT_LIKE_DOWNLOAD_WORKERS,
+                 min_interval=1.0, max_interval=60.0, backoff=2.0, jitter=0.1):
+        self.check = check
+        self.download = download
+        self.workers = workers
+        self.download_workers = download_workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+
+        self.condition = Condition()
+        self.users = {}
+        self.schedule = []      # heap of (next poll, tie breaker, user id)
+        self.tiebreaker = itertools.count()
+        self.running = False
+        self.thread = None
+        self.executor = None
+
+        self.downloads = Queue()
+        self.queued_tracks = set()
+        self.queued_lock = Lock()
+        self.download_threads = []
+
+    def add(self, user_id, username):
+        """ Starts watching a user, returns False if they were already watched. """
+        with self.condition:
+            if user_id in self.users:
+                return False
+            user = WatchedUser(user_id, username, self.min_interval, time.time() + random.uniform(0, self.min_interval))
+            self.users[user_id] = user
+            heapq.heappush(self.schedule, (user.next_poll, next(self.tiebreaker), user_id))
+            self.condition.notify_all()
+        return True
+
+    def remove(self, user_id):
+        # Its schedule entry is dropped when it comes up
+        with self.condition:
+            return self.users.pop(user_id, None) is not None
+
+    def watched(self):
+        with self.condition:
+            return list(self.users.values())
+
+    def next_delay(self, user, active):
+        if active:
+            user.interval = self.min_interval
+        else:
+            user.interval = min(self.max_interval, user.interval * self.backoff)
+
+        delay = user.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        delay = max(delay, user.deferred)
+        user.deferred = 0.0
+        return delay
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        # Download workers outlive stop(), so likes that were already found still get downloaded
+        if len(self.download_threads) == 0:
+            self.download_threads = [Thread(target=self.run_downloads, daemon=True) for i in range(self.download_workers)]
+            for thread in self.download_threads:
+                thread.start()
+
+    def stop(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.executor.shutdown(wait=False)
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                now = time.time()
+                if len(self.schedule) == 0 or self.schedule[0][0] > now:
+                    self.condition.wait(self.schedule[0][0] - now if len(self.schedule) > 0 else None)
+                    continue
+
+                next_poll, _, user_id = heapq.heappop(self.schedule)
+                user = self.users.get(user_id)
+                # Users that got removed (or re-added since) have left stale entries behind
+                if user is not None and user.next_poll == next_poll:
+                    self.executor.submit(self.poll, user)
+
+    def poll(self, user):
+        try:
+            active = self.check(user) > 0
+        except Exception as e:
+            Log.instance().error("Checking the likes of \"{user}\" failed: {error}".format(user=user.username, error=e))
+            active = False
+
+        with self.condition:
+            if self.users.get(user.user_id) is not user:
+                return
+            user.next_poll = time.time() + self.next_delay(user, active)
+            heapq.heappush(self.schedule, (user.next_poll, next(self.tiebreaker), user.user_id))
+            self.condition.notify_all()
+
+    def enqueue(self, track_id):
+        """ Queues a liked track for download, once even if several watched users like it. """
+        with self.queued_lock:
+            if track_id in self.queued_tracks:
+                return
+            self.queued_tracks.add(track_id)
+        self.downloads.put(track_id)
+
+    def run_downloads(self):
+        while True:
+            track_id = self.downloads.get()
+            try:
+                self.download(track_id)
+            except Exception as e:
+                Log.instance().error("Downloading liked track {track_id} failed: {error}".format(track_id=track_id, error=e))
+            finally:
+                with self.queued_lock:
+                    self.queued_tracks.discard(track_id)